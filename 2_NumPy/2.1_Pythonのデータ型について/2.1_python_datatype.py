@@ -84,4 +84,185 @@ np.linspace(0, 1, 5)                # 0と1の間に均等に配置された5つ
 # → array([0. , 0.25, 0.5, 0.75, 1. ])
 
 np.random.random((3, 3))            # 0と1の間に均一に分布したランダムな値の3行3列の配列を作る
-np.random.randint(0, 10, (3, 3))    # 区間[0, 10)のランダムな整数で3行3列の配列を作る
\ No newline at end of file
+np.random.randint(0, 10, (3, 3))    # 区間[0, 10)のランダムな整数で3行3列の配列を作る
+
+
+
+
+
+# ---------------------------------------------------------------
+# ----- 2.1.6 発展：バッファプロトコルを使ったゼロコピーの取り込み -----
+# ---------------------------------------------------------------
+# 2.1.4のnp.array([...])は，Pythonのリストから値を1つずつ取り出して新しい配列にコピーする．
+# しかし，bytes，bytearray，array.array，mmapのようなオブジェクトは，
+# 値をC言語の配列と同じ形でメモリ上に持っている(バッファプロトコル)．
+# np.frombufferを使えば，dtype(バイト順を含む)を指定するだけで，コピーせずにNumPy配列として扱える．
+A = array.array('i', L)
+np.frombuffer(A, dtype='i')
+# → array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=int32)
+
+# ただし，配列はもとのバッファのメモリをそのまま参照するので，
+# バッファより長く配列を使い続けないように注意が必要．
+# そこで，バッファから作ったビューを記録しておき，ビューが残っている間はバッファを閉じられないようにする．
+import mmap
+import socket
+import time
+import weakref
+
+class BufferIngest:
+    # bytes，bytearray，array.array，mmapなどのバッファから，コピーせずに型付きの配列を作る．
+    # with文で使うと，ブロックを抜けるときにバッファを解放する(mmapは閉じる)．
+    def __init__(self, buf):
+        self.buf = buf
+        self.mem = memoryview(buf).cast('B')
+        self.views = []   # ビューへの弱参照(ndarrayはハッシュできないのでリストで持つ)
+
+    def view(self, dtype, offset=0, count=-1, stride=None):
+        # offsetバイト目からcount個のレコードを配列として返す．
+        # strideを指定すると，レコードの間隔(バイト数)がdtypeの大きさと異なるデータも扱える．
+        if self.mem is None:
+            raise ValueError("buffer is already released")
+        dtype = np.dtype(dtype)
+        if stride is None or stride == dtype.itemsize:
+            arr = np.frombuffer(self.mem, dtype=dtype, count=count, offset=offset)
+        else:
+            if count < 0:
+                count = (len(self.mem) - offset - dtype.itemsize) // stride + 1
+            arr = np.ndarray((count,), dtype=dtype, buffer=self.mem, offset=offset, strides=(stride,))
+        self.views.append(weakref.ref(arr))
+        return arr
+
+    def live_views(self):
+        self.views = [r for r in self.views if r() is not None]
+        return len(self.views)
+
+    def release(self):
+        # ビューが残っていればBufferErrorとする(解放後のメモリを読み書きしないように)
+        if self.mem is None:
+            return
+        n = self.live_views()
+        if n:
+            raise BufferError("{0} array view(s) still reference this buffer".format(n))
+        self.mem.release()
+        self.mem = None
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# 2.9の構造化配列と同じレコード型(リトルエンディアン)をバイト列から読み込む．
+record = np.dtype([('name', '<U10'), ('age', '<i4'), ('weight', '<f8')])
+raw = np.array([('Alice', 25, 55.0), ('Bob', 45, 85.5)], dtype=record).tobytes()
+
+with BufferIngest(raw) as ingest:
+    people = ingest.view(record)
+    print(people['age'])
+    # [25 45]
+    del people   # with文を抜ける前にビューを手放す
+
+# ヘッダの後にパディング付きのレコードが並んでいる場合は，offsetとstrideを指定する．
+packet = bytearray(8) + b''.join(np.int32(v).tobytes() + bytes(4) for v in [7, 8, 9])
+ingest = BufferIngest(packet)
+values = ingest.view('<i4', offset=8, stride=8)
+print(values)
+# [7 8 9]
+# ingest.release()   # valuesが残っているので BufferError になる
+del values
+ingest.release()
+
+
+# ソケットなどから届くレコードを，あらかじめ確保したリングバッファに直接受信する．
+# 容量はレコードの大きさの倍数にするので，レコードがバッファの終端をまたぐことはない．
+class RecordRing:
+    def __init__(self, dtype, capacity):
+        self.dtype = np.dtype(dtype)
+        self.nbytes = self.dtype.itemsize * capacity
+        self.buf = bytearray(self.nbytes)
+        self.mem = memoryview(self.buf)
+        self.head = 0   # これまでに読み出した(消費した)バイト数
+        self.tail = 0   # これまでに書き込んだバイト数
+
+    def writable(self):
+        # 次に書き込める連続した領域(recv_intoなどに渡す)
+        start = self.tail % self.nbytes
+        free = self.nbytes - (self.tail - self.head)
+        return self.mem[start:start + min(free, self.nbytes - start)]
+
+    def commit(self, n):
+        self.tail += n
+
+    def recv_from(self, sock):
+        # ソケットから空き領域に直接受信する．受信したバイト数を返す．
+        n = sock.recv_into(self.writable())
+        self.commit(n)
+        return n
+
+    def write(self, data):
+        # bytesなどを書き込む(バッファが一杯ならBufferError)
+        data = memoryview(data).cast('B')
+        while len(data):
+            region = self.writable()
+            if len(region) == 0:
+                raise BufferError("ring buffer is full")
+            n = min(len(region), len(data))
+            region[:n] = data[:n]
+            self.commit(n)
+            data = data[n:]
+
+    def records(self):
+        # 受信済みの完全なレコードを，コピーせずに高々2つの配列ビューとして返す
+        item = self.dtype.itemsize
+        n = (self.tail - self.head) // item
+        start = (self.head % self.nbytes) // item
+        capacity = self.nbytes // item
+        first = min(n, capacity - start)
+        arr = np.frombuffer(self.buf, dtype=self.dtype)
+        parts = [arr[start:start + first]]
+        if n > first:
+            parts.append(arr[:n - first])
+        return parts
+
+    def consume(self, n_records):
+        self.head += n_records * self.dtype.itemsize
+
+
+ring = RecordRing('<i4', capacity=4)
+ring.write(np.arange(3, dtype='<i4').tobytes())
+ring.consume(2)
+ring.write(np.arange(3, 6, dtype='<i4').tobytes())
+print(ring.records())
+# [array([2, 3], dtype=int32), array([4, 5], dtype=int32)]   (終端で折り返した分は2つ目のビューになる)
+
+# ソケットからの受信
+a, b = socket.socketpair()
+a.sendall(np.arange(2, dtype='<i4').tobytes())
+ring.consume(4)
+ring.recv_from(b)
+print(ring.records())
+# [array([0, 1], dtype=int32)]
+a.close()
+b.close()
+
+
+# np.array(list)による変換と比較する．
+def benchmark_ingest(n=10**7):
+    L = list(range(n))
+    raw = np.arange(n, dtype='<i4').tobytes()
+    t0 = time.perf_counter()
+    np.array(L, dtype='<i4')
+    t_list = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    np.array(array.array('i', L))
+    t_copy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    BufferIngest(raw).view('<i4')
+    t_view = time.perf_counter() - t0
+    print("np.array(list): {0:.3f} s, np.array(array.array): {1:.3f} s, BufferIngest.view: {2:.6f} s".format(
+        t_list, t_copy, t_view))
+
+#benchmark_ingest()
\ No newline at end of file
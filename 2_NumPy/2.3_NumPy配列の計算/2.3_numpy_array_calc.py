@@ -147,4 +147,589 @@ np.add.reduce(x)
 
 # 中間結果を残したい場合は，代わりにaccumulateを使う．
 np.add.accumulate(x)
-# array([1, 3, 6, 10, 15])
\ No newline at end of file
+# array([1, 3, 6, 10, 15])
+
+
+
+
+
+# ----------------------------------------------------------
+# ----- 2.3.5 発展：ブロック分割による並列累積(スキャン) -----
+# ----------------------------------------------------------
+# 2.3.4.2のnp.add.accumulate(x)やnp.multiply.accumulate(x)は，NumPyでは1つのコアで先頭から順に計算される．
+# 結合則が成り立つ演算(加算，乗算，最小，最大，論理演算)であれば，次の3段階で並列化できる．
+#   1. 配列をブロックに分け，各ブロックの累積をスレッドプール上で並列に計算する．
+#   2. 各ブロックの最後の値(ブロックの合計)だけを累積する．これは要素数がブロック数なので一瞬で終わる．
+#   3. 1つ前までのブロックの累積値を，各ブロックに並列に加える．
+# compensated=Trueを指定すると，浮動小数点の加算で生じる丸め誤差を補正する(補償加算)．
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_scan_ufuncs = (np.add, np.multiply, np.minimum, np.maximum,
+                np.logical_and, np.logical_or, np.logical_xor)
+
+def _compensated_cumsum(x, out):
+    # np.cumsumの各加算で失われた誤差をTwoSumで求め，その累積を足し戻す
+    np.add.accumulate(x, axis=0, out=out)
+    prev = np.zeros_like(out)
+    prev[1:] = out[:-1]
+    bb = out - prev
+    err = (prev - (out - bb)) + (x - bb)
+    # 誤差の累積は(float32の場合も)float64で行う
+    out += np.add.accumulate(err, axis=0, dtype=np.promote_types(err.dtype, np.float64)).astype(out.dtype)
+    return out
+
+def parallel_accumulate(ufunc, x, out=None, compensated=False, block=None, n_workers=None):
+    # ufunc.accumulate(x, axis=0)と同じ結果をoutに書き込む．out=xとすればその場で計算する．
+    if ufunc not in _scan_ufuncs:
+        raise ValueError("ufunc must be one of add, multiply, minimum, maximum or logical ops")
+    if compensated and ufunc is not np.add:
+        raise ValueError("compensated=True is only supported for np.add")
+    x = np.asarray(x)
+    if out is None:
+        # add，multiplyはint8やboolをint64に広げるので，ufunc.accumulateと同じ型で確保する
+        out = np.empty(x.shape, dtype=ufunc.accumulate(x[:1], axis=0).dtype)
+    n = x.shape[0]
+    if n == 0:
+        return out
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if block is None:
+        block = max(1, -(-n // (4 * n_workers)))
+    bounds = [(start, min(start + block, n)) for start in range(0, n, block)]
+
+    # 1. ブロックごとの累積
+    def local_scan(b):
+        start, stop = b
+        if compensated:
+            _compensated_cumsum(np.array(x[start:stop], dtype=out.dtype), out[start:stop])
+        else:
+            ufunc.accumulate(x[start:stop], axis=0, dtype=out.dtype, out=out[start:stop])
+    with ThreadPoolExecutor(n_workers) as pool:
+        list(pool.map(local_scan, bounds))
+
+    # 2. ブロックの合計の累積
+    totals = np.array([out[stop - 1] for start, stop in bounds])
+    if compensated:
+        carry = _compensated_cumsum(totals, np.empty_like(totals))
+    else:
+        carry = ufunc.accumulate(totals, axis=0)
+
+    # 3. 前のブロックまでの累積値を加える
+    def add_offset(i):
+        start, stop = bounds[i]
+        ufunc(out[start:stop], carry[i - 1], out=out[start:stop])
+    with ThreadPoolExecutor(n_workers) as pool:
+        list(pool.map(add_offset, range(1, len(bounds))))
+    return out
+
+
+# 2.3.4.2の例と同じ結果が得られる．
+x = np.arange(1, 6)
+parallel_accumulate(np.add, x, block=2)
+# array([ 1,  3,  6, 10, 15])
+parallel_accumulate(np.multiply, x, block=2)
+# array([  1,   2,   6,  24, 120])
+
+# 結果をoutに書き込んだり，その場で計算したりできる．
+y = np.empty(5, dtype=int)
+parallel_accumulate(np.maximum, np.array([3, 1, 4, 1, 5]), out=y, block=2)
+# array([3, 3, 4, 4, 5])
+
+# 整数やブール値の累積もufunc.accumulateと同じ型(int8などはint64)で計算される．
+for ufunc in [np.add, np.multiply, np.maximum, np.logical_xor]:
+    for z in [np.random.randint(-3, 4, 1000).astype(np.int8),
+              np.full(1000, 2**30, dtype=np.int32),
+              np.random.rand(1000) < 0.5]:
+        expected = ufunc.accumulate(z, axis=0)
+        result = parallel_accumulate(ufunc, z, block=64)
+        assert result.dtype == expected.dtype and np.array_equal(result, expected)
+
+# float32で大量の値を足し合わせると，np.cumsumでは丸め誤差が蓄積するが，補償加算では抑えられる．
+v = np.full(10**6, 0.1, dtype=np.float32)
+exact = np.cumsum(v.astype(np.float64))
+print(np.abs(np.cumsum(v) - exact).max())
+print(np.abs(parallel_accumulate(np.add, v, compensated=True) - exact).max())
+# 958.3422598838806
+# 0.004615113139152527  (float32の1ulpの範囲内)
+
+
+# 1e6から1e9要素まで，np.cumsumと速度を比較する．
+def benchmark_parallel_accumulate(sizes=(10**6, 10**7, 10**8, 10**9)):
+    for n in sizes:
+        x = np.ones(n, dtype=np.float32)
+        out = np.empty_like(x)
+        t0 = time.perf_counter()
+        np.cumsum(x, out=out)
+        t_numpy = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        parallel_accumulate(np.add, x, out=out)
+        t_par = time.perf_counter() - t0
+        print("n={0:.0e}: np.cumsum {1:.3f} s, parallel {2:.3f} s (x{3:.1f})".format(
+            n, t_numpy, t_par, t_numpy / t_par))
+
+#benchmark_parallel_accumulate()
+
+
+
+
+
+# ----------------------------------------------------------------
+# ----- 2.3.6 発展：外積を作らずに集約する(タイル分割したufunc.outer) -----
+# ----------------------------------------------------------------
+# ufuncのouterメソッドを使うと，2つの配列のすべての組み合わせに対する演算結果を計算できる．
+x = np.arange(1, 6)
+np.multiply.outer(x, x)
+# array([[ 1,  2,  3,  4,  5],
+#        [ 2,  4,  6,  8, 10],
+#        [ 3,  6,  9, 12, 15],
+#        [ 4,  8, 12, 16, 20],
+#        [ 5, 10, 15, 20, 25]])
+
+# しかし，外積はすぐに集約されることが多い(例えば，行ごとの合計や，しきい値未満の組み合わせの数)．
+# n×mの結果を一度に作るとO(nm)のメモリが必要になるので，
+# タイルごとに外積を計算してすぐに集約し，タイルを捨てる．
+# タイルの行ブロックはスレッドプールで並列に処理し，メモリ使用量はタイルの大きさで抑えられる．
+def _tiled_outer(ufunc, a, b, axis, tile, n_workers, reduce_tile, combine, write):
+    # axis=1ならaの各要素について(bの方向に)，axis=0ならbの各要素について(aの方向に)集約する
+    a = np.asarray(a)
+    b = np.asarray(b)
+    keep_n, loop_n = (a.shape[0], b.shape[0]) if axis == 1 else (b.shape[0], a.shape[0])
+    def work(i0):
+        i1 = min(i0 + tile, keep_n)
+        acc = None
+        for j0 in range(0, loop_n, tile):
+            j1 = min(j0 + tile, loop_n)
+            if axis == 1:
+                T = ufunc.outer(a[i0:i1], b[j0:j1])
+            else:
+                T = ufunc.outer(a[j0:j1], b[i0:i1])
+            part = reduce_tile(T, j0)
+            acc = part if acc is None else combine(acc, part)
+        write(i0, i1, acc)
+    with ThreadPoolExecutor(n_workers) as pool:
+        list(pool.map(work, range(0, keep_n, tile)))
+
+def outer_reduce(ufunc, reduce_ufunc, a, b, axis=1, tile=1024, n_workers=None):
+    # reduce_ufunc.reduce(ufunc.outer(a, b), axis=axis)と同じ結果を，外積を作らずに求める．
+    # axis=Noneならすべての要素を集約したスカラーを返す．
+    if axis is None:
+        return reduce_ufunc.reduce(outer_reduce(ufunc, reduce_ufunc, a, b, 1, tile, n_workers))
+    result = [None] * -(-(len(a) if axis == 1 else len(b)) // tile)
+    def write(i0, i1, acc):
+        result[i0 // tile] = acc
+    _tiled_outer(ufunc, a, b, axis, tile, n_workers,
+                 lambda T, j0: reduce_ufunc.reduce(T, axis=axis), reduce_ufunc, write)
+    return np.concatenate(result)
+
+def outer_count(ufunc, a, b, threshold, compare=np.less, axis=None, tile=1024, n_workers=None):
+    # compare(ufunc.outer(a, b), threshold)を満たす組み合わせの数を数える．
+    # axis=Noneなら総数を，axis=1(0)ならaの(bの)各要素ごとの数を返す．
+    keep = 0 if axis == 0 else 1
+    result = [None] * -(-(len(b) if keep == 0 else len(a)) // tile)
+    def write(i0, i1, acc):
+        result[i0 // tile] = acc
+    _tiled_outer(ufunc, a, b, keep, tile, n_workers,
+                 lambda T, j0: np.count_nonzero(compare(T, threshold), axis=keep),
+                 np.add, write)
+    counts = np.concatenate(result)
+    return counts.sum() if axis is None else counts
+
+def outer_arg(ufunc, a, b, axis=1, kind='min', tile=1024, n_workers=None):
+    # np.argmin(ufunc.outer(a, b), axis=axis)(kind='max'ならargmax)と同じインデクスと，その値を返す．
+    # 同じ値が複数ある場合は，np.argminと同じく最初のものを選ぶ．
+    better = np.less if kind == 'min' else np.greater
+    argfunc = np.argmin if kind == 'min' else np.argmax
+    n = len(a) if axis == 1 else len(b)
+    values = np.empty(n, dtype=ufunc(np.asarray(a)[:1], np.asarray(b)[:1]).dtype)
+    indices = np.empty(n, dtype=np.intp)
+    def reduce_tile(T, j0):
+        idx = argfunc(T, axis=axis)
+        val = np.take_along_axis(T, np.expand_dims(idx, axis), axis=axis).squeeze(axis)
+        return val, idx + j0
+    def combine(acc, part):
+        # 後のタイルは値が真に良い場合だけ採用する．
+        # np.argmin/np.argmaxはNaNを最良とみなすので，最初のNaNが残るようにする
+        part_nan, acc_nan = np.isnan(part[0]), np.isnan(acc[0])
+        update = (part_nan & ~acc_nan) | (~acc_nan & better(part[0], acc[0]))
+        return np.where(update, part[0], acc[0]), np.where(update, part[1], acc[1])
+    def write(i0, i1, acc):
+        values[i0:i1], indices[i0:i1] = acc
+    _tiled_outer(ufunc, a, b, axis, tile, n_workers, reduce_tile, combine, write)
+    return indices, values
+
+
+# 小さな入力で，外積を作ってから集約した結果と一致することを確認する．
+rng = np.random.RandomState(0)
+a = rng.rand(1000)
+b = rng.rand(700)
+print(np.allclose(outer_reduce(np.multiply, np.add, a, b, axis=1, tile=64),
+                  np.multiply.outer(a, b).sum(1)))
+print(np.allclose(outer_reduce(np.multiply, np.add, a, b, axis=0, tile=64),
+                  np.multiply.outer(a, b).sum(0)))
+print(outer_count(np.subtract, a, b, 0.01, compare=lambda d, t: np.abs(d) < t, tile=64)
+      == np.count_nonzero(np.abs(np.subtract.outer(a, b)) < 0.01))
+print(np.array_equal(outer_arg(np.subtract, a, b, axis=1, kind='max', tile=64)[0],
+                     np.argmax(np.subtract.outer(a, b), axis=1)))
+# 後のタイルにNaNがある場合も，np.argminと同じく最初のNaNのインデクスを返す
+b_nan = b.copy()
+b_nan[[100, 300, 650]] = np.nan
+print(np.array_equal(outer_arg(np.subtract, a, b_nan, axis=1, kind='min', tile=64)[0],
+                     np.argmin(np.subtract.outer(a, b_nan), axis=1)))
+# True
+# True
+# True
+# True
+# True
+
+
+
+
+
+# -------------------------------------------------------------
+# ----- 2.3.7 発展：精度を選べる高速な三角関数・指数関数・対数関数 -----
+# -------------------------------------------------------------
+# 2.3.3.3，2.3.3.4のnp.sin，np.exp，np.logなどは，デフォルトでfloat64の完全な精度で計算される．
+# 相対誤差1e-4程度で十分な用途なら，float32の多項式近似の方が速い．
+# ここでは，範囲縮小(引数を狭い区間に移す)と多項式近似を組み合わせて，
+# 'low'，'medium'，'high'の3段階の精度を選べる関数を作る．
+# 多項式はHorner法で，out引数に直接書き込みながら評価する．
+# ただし，NumPy 1.22以降ではfloat32版のufuncがSIMD化されていて，
+# 中間配列を何度も読み書きする多項式近似よりもずっと速い(下のレポートを参照)．
+# そのため，デフォルトのtier='float32'ではNumPyのfloat32版ufuncをそのまま使い，
+# 多項式近似の各精度は，SIMD化されていない環境で使うためのものとする．
+
+# 各精度で使う多項式の次数(テイラー展開の係数を用いる)
+# 'low'は相対誤差1e-4以下，'medium'は1e-5以下，'high'はfloat32の数ulpを目標とする．
+# ただし，多項式近似はどの精度でもfloat64のnp.sinなどより遅い(fastmath_report()の結果を参照)．
+FASTMATH_TIERS = {
+    #          sinの次数  cosの次数  exp(f)の次数  logの級数の項数
+    'low':    dict(sin=5, cos=6, exp=4, log=3),
+    'medium': dict(sin=7, cos=6, exp=5, log=3),
+    'high':   dict(sin=9, cos=8, exp=7, log=4),
+}
+
+# 各精度の最大誤差(float32の1ulpを単位とした値, 相対誤差)．下のfastmath_report()で1e7点について測定した値．
+# sin/cosは|x| <= 100，expは|x| <= 80，logは1e-35から1e35の範囲で測定した．
+# sin/cosの範囲縮小はfloat64で行うので，|x| <= 2**24まで同じ精度になる．それより大きい|x|ではnp.sin/np.cosを使う．
+FASTMATH_MAX_ERROR = {
+    'low':     dict(sin=(304.7, 3.6e-5),  cos=(304.7, 3.6e-5),  exp=(661.5, 5.6e-5), log=(44.3, 3.8e-6)),
+    'medium':  dict(sin=(30.5, 3.6e-6),   cos=(30.5, 3.6e-6),   exp=(39.4, 3.3e-6),  log=(44.3, 3.8e-6)),
+    'high':    dict(sin=(0.9, 1.0e-7),    cos=(0.9, 1.1e-7),    exp=(1.2, 1.0e-7),   log=(3.0, 2.6e-7)),
+    'float32': dict(sin=(0.6, 7.0e-8),    cos=(0.6, 7.0e-8),    exp=(2.4, 2.1e-7),   log=(3.1, 2.5e-7)),
+}
+
+_SINCOS_MAX = np.float32(2**24)               # 多項式近似を使う|x|の上限(これより大きい値やinf，NaNはnp.sin/np.cos)
+_LN2 = np.float32(np.log(2))
+_LN2_HI = np.float32(0.693145751953125)       # log(2)の上位ビット
+_LN2_LO = np.float32(np.log(2) - 0.693145751953125)
+_LOG2E = np.float32(1 / np.log(2))
+
+def _horner(r, coefs, out):
+    # coefsは高次の係数から並べる．out = ((c0 * r + c1) * r + c2) ...
+    out[...] = coefs[0]
+    for c in coefs[1:]:
+        np.multiply(out, r, out=out)
+        out += np.float32(c)
+    return out
+
+def _taylor(kind, degree):
+    # sin，cosのテイラー係数(r**2の多項式として，高次から並べる)
+    from math import factorial
+    start = 1 if kind == 'sin' else 0
+    return [(-1) ** (k // 2) / factorial(k) for k in range(start, degree + 1, 2)][::-1]
+
+def _prepare(x, out):
+    x = np.asarray(x, dtype=np.float32)
+    if out is None:
+        out = np.empty(x.shape, dtype=np.float32)
+    return x, out
+
+def _sincos(x, tier, out, shift):
+    # 範囲縮小：x = k * (π/2) + r，|r| <= π/4
+    # float32でk * (π/2)を引くと，|x|が大きいときに桁落ちで誤差が大きくなる(1e7では符号も合わない)．
+    # そこで範囲縮小だけはfloat64で行う．|x| <= 2**24ならrの誤差はfloat32の丸め誤差より十分小さい．
+    x, out = _prepare(x, out)
+    ref = np.cos if shift else np.sin
+    if tier == 'float32':
+        return ref(x, out=out)
+    deg = FASTMATH_TIERS[tier]
+    fallback = ~(np.abs(x) <= _SINCOS_MAX)
+    x_fallback = x[fallback]   # out is xの場合に備えて，outに書き込む前に取り出しておく
+    x64 = np.where(fallback, 0, x).astype(np.float64)
+    k = np.rint(x64 * (2 / np.pi))
+    r = (x64 - k * (np.pi / 2)).astype(np.float32)
+    r2 = r * r
+    # sin(r) = r * P(r**2)，cos(r) = Q(r**2)
+    s = _horner(r2, _taylor('sin', deg['sin']), np.empty_like(r))
+    s *= r
+    c = _horner(r2, _taylor('cos', deg['cos']), np.empty_like(r))
+    # kを4で割った余りで，sin/cosの入れ替えと符号を決める
+    q = (k.astype(np.int64) + shift) & 3
+    np.copyto(out, np.where(q & 1, c, s))
+    np.negative(out, out=out, where=q >= 2)
+    out[fallback] = ref(x_fallback)
+    return out
+
+def fast_sin(x, tier='float32', out=None):
+    return _sincos(x, tier, out, 0)
+
+def fast_cos(x, tier='float32', out=None):
+    # cos(x) = sin(x + π/2)
+    return _sincos(x, tier, out, 1)
+
+def fast_exp(x, tier='float32', out=None):
+    # exp(x) = 2**n * exp(f)，nは整数，|f| <= log(2)/2
+    x, out = _prepare(x, out)
+    if tier == 'float32':
+        return np.exp(x, out=out)
+    # float32ではexp(x)はx > 88.72でinfに，x < -103.98で0になる．
+    # その外側の値はこの範囲に収めておき，最後のnp.ldexpでinfや0(非正規化数)にする．
+    nan = np.isnan(x)
+    x = np.clip(x, -104.0, 89.0)
+    n = np.rint(x * _LOG2E)
+    n[nan] = 0
+    f = x - n * _LN2_HI
+    f -= n * _LN2_LO
+    from math import factorial
+    _horner(f, [1 / factorial(k) for k in range(FASTMATH_TIERS[tier]['exp'], -1, -1)], out)
+    with np.errstate(over='ignore', under='ignore'):
+        np.ldexp(out, n.astype(np.int32), out=out)
+    np.copyto(out, np.nan, where=nan)
+    return out
+
+def fast_log(x, tier='float32', out=None):
+    # x = m * 2**e，sqrt(1/2) <= m < sqrt(2)とし，
+    # log(m) = 2 * (s + s**3/3 + s**5/5 + ...)，s = (m - 1) / (m + 1)を使う
+    x, out = _prepare(x, out)
+    if tier == 'float32':
+        return np.log(x, out=out)
+    # out is x(その場での計算)の場合に備えて，定義域外の位置はoutに書き込む前に求めておく
+    zero, negative, posinf = (x == 0), (x < 0), np.isposinf(x)
+    # 定義域外の値の途中計算で出る0除算などの警告は出さない(最後にnp.logと同じ値にする)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m, e = np.frexp(x)
+        small = m < np.float32(np.sqrt(0.5))
+        m = np.where(small, m * 2, m)
+        e = e - small
+        s = (m - 1) / (m + 1)
+        terms = FASTMATH_TIERS[tier]['log']
+        _horner(s * s, [2 / (2 * k + 1) for k in range(terms - 1, -1, -1)], out)
+        out *= s
+        out += e.astype(np.float32) * _LN2
+    # 定義域外の値はnp.logと同じにする
+    np.copyto(out, -np.inf, where=zero)
+    np.copyto(out, np.nan, where=negative)
+    np.copyto(out, np.inf, where=posinf)
+    return out
+
+def fast_pow(x, y, tier='float32', out=None):
+    # x**y = exp(y * log|x|)．誤差は|y * log(x)|に比例して大きくなる．
+    # np.powerと同じく，x < 0ではyが整数なら符号を付け(奇数なら負)，整数でなければNaNとする．
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float32), np.asarray(y, dtype=np.float32))
+    x, out = _prepare(x, out)
+    if tier == 'float32':
+        return np.power(x, y, out=out)
+    if np.shares_memory(y, out):
+        y = y.copy()   # outにlog(x)を書き込むとyが壊れるので，先にコピーしておく
+    # outに書き込む前に，xの符号とyが整数かどうかを調べておく
+    negative, one = x < 0, x == 1
+    integer = y == np.rint(y)
+    odd = integer & (np.fmod(y, 2) != 0)
+    fast_log(np.abs(x), tier, out=out)
+    with np.errstate(invalid='ignore'):
+        out *= y
+    fast_exp(out, tier, out=out)
+    np.negative(out, out=out, where=negative & odd)
+    np.copyto(out, np.nan, where=negative & ~integer)
+    np.copyto(out, 1, where=(y == 0) | one)   # np.powerと同じく，x**0と1**yは(0やNaNでも)1
+    return out
+
+
+# 2.3.3.3，2.3.3.4と同じ値を計算してみる．
+theta = np.linspace(0, np.pi, 3)
+print("sin(theta) = ", fast_sin(theta))
+print("cos(theta) = ", fast_cos(theta))
+print("e^x        = ", fast_exp([1, 2, 3]))
+print("ln(x)      = ", fast_log([1, 2, 4, 10]))
+print("3^x        = ", fast_pow(3, [1, 2, 3]))
+
+# 多項式近似の精度を指定する場合
+fast_sin(theta, tier='low')
+
+
+# NumPyのufunc(float64)と比べた精度とスループットのレポート．
+def fastmath_report(n=10**7):
+    rng = np.random.RandomState(0)
+    cases = {
+        'sin': (fast_sin, np.sin, rng.uniform(-100, 100, n)),
+        'cos': (fast_cos, np.cos, rng.uniform(-100, 100, n)),
+        'exp': (fast_exp, np.exp, rng.uniform(-80, 80, n)),
+        'log': (fast_log, np.log, np.exp(rng.uniform(-80, 80, n))),
+    }
+    for name, (fast, ref, x) in cases.items():
+        x32 = x.astype(np.float32)
+        # 入力をfloat32に丸めた後の値を基準にする
+        exact = ref(x32.astype(np.float64))
+        t0 = time.perf_counter()
+        ref(x)
+        t_ref = time.perf_counter() - t0
+        out = np.empty_like(x32)
+        for tier in list(FASTMATH_TIERS) + ['float32']:
+            t0 = time.perf_counter()
+            fast(x32, tier, out=out)
+            t_fast = time.perf_counter() - t0
+            err = np.abs(out - exact)
+            # sin/cosは0付近で相対誤差が意味を持たないので，絶対誤差を1ulp(1.0)で評価する
+            scale = np.maximum(np.abs(exact), 1.0) if name in ('sin', 'cos') else np.abs(exact)
+            ulp = (err / np.spacing(scale.astype(np.float32))).max()
+            rel = (err / scale).max()
+            print("{0} {1:<7}: max {2:.1f} ulp, rel {3:.1e}, {4:.3f} s (np.{0}: {5:.3f} s)".format(
+                name, tier, ulp, rel, t_fast, t_ref))
+
+#fastmath_report()
+# sin low    : max 304.7 ulp, rel 3.6e-05, 0.675 s (np.sin: 0.369 s)
+# sin medium : max 30.5 ulp, rel 3.6e-06, 0.664 s (np.sin: 0.369 s)
+# sin high   : max 0.9 ulp, rel 1.0e-07, 0.770 s (np.sin: 0.369 s)
+# sin float32: max 0.6 ulp, rel 7.0e-08, 0.012 s (np.sin: 0.369 s)
+# ...
+
+
+
+
+
+# ----------------------------------------------------
+# ----- 2.3.8 発展：再現可能な並列乱数ストリーム -----
+# ----------------------------------------------------
+# 2.3.1のnp.random.seed(0)は，プロセス全体で1つの乱数生成器(レガシーなグローバル生成器)を初期化する．
+# 1つの生成器から順に乱数を取り出すので，複数のスレッドやプロセスで分担すると，
+# 取り出す順番によって結果が変わってしまい，再現性がなくなる．
+# そこで，np.random.Generatorとnp.random.SeedSequenceを使い，
+# 出力を固定の大きさ(block)のブロックに分けて，ブロックごとに独立したストリームを割り当てる．
+# ブロックi番目のストリームは(呼び出し回数, i)をspawn_keyとするSeedSequenceから作るので，
+# 同じシードとblockであれば，ワーカー数に関係なく同じ乱数列になる．
+from concurrent.futures import ProcessPoolExecutor
+
+class ParallelRandom:
+    def __init__(self, seed=None, block=2**20, n_workers=None):
+        self.seed_seq = np.random.SeedSequence(seed)
+        self.block = block
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count()
+        self.calls = 0   # 呼び出しごとに異なるストリームを使う
+
+    def _stream(self, call, i):
+        seq = np.random.SeedSequence(self.seed_seq.entropy,
+                                     spawn_key=self.seed_seq.spawn_key + (call, i))
+        return np.random.Generator(np.random.PCG64(seq))
+
+    def _fill(self, size, dtype, out, draw):
+        # draw(gen, buf)でブロックbufを埋める．outを渡せばそこに書き込む．
+        # C連続でないout(スライスなど)は，C連続な一時配列を埋めてから行優先の順にコピーする．
+        if out is None:
+            out = np.empty(size, dtype=dtype)
+        elif not out.flags.c_contiguous:
+            np.copyto(out, self._fill(None, None, np.empty(out.shape, dtype=out.dtype), draw))
+            return out
+        flat = out.reshape(-1)
+        call = self.calls
+        self.calls += 1
+        def work(i):
+            draw(self._stream(call, i), flat[i * self.block:(i + 1) * self.block])
+        n_blocks = -(-flat.size // self.block)
+        with ThreadPoolExecutor(self.n_workers) as pool:
+            list(pool.map(work, range(n_blocks)))
+        return out
+
+    def random(self, size=None, dtype=np.float64, out=None):
+        # [0, 1)の一様乱数
+        return self._fill(size, dtype, out, lambda g, b: g.random(out=b, dtype=b.dtype))
+
+    def uniform(self, low=0.0, high=1.0, size=None, dtype=np.float64, out=None):
+        def draw(g, b):
+            g.random(out=b, dtype=b.dtype)
+            b *= high - low
+            b += low
+        return self._fill(size, dtype, out, draw)
+
+    def standard_normal(self, size=None, dtype=np.float64, out=None):
+        return self._fill(size, dtype, out, lambda g, b: g.standard_normal(out=b, dtype=b.dtype))
+
+    def normal(self, loc=0.0, scale=1.0, size=None, dtype=np.float64, out=None):
+        def draw(g, b):
+            g.standard_normal(out=b, dtype=b.dtype)
+            b *= scale
+            b += loc
+        return self._fill(size, dtype, out, draw)
+
+    def integers(self, low, high, size=None, dtype=np.int64, out=None):
+        def draw(g, b):
+            b[...] = g.integers(low, high, b.size, dtype=b.dtype)
+        return self._fill(size, dtype, out, draw)
+
+    def spawn(self, n):
+        # プロセスプールのワーカーなどに渡す，独立したn個のSeedSequence(pickle可能)
+        return self.seed_seq.spawn(n)
+
+    def map(self, func, n_tasks, processes=False):
+        # タスクiに対してfunc(Generator, i)を計算する．タスクごとのストリームは固定なので，
+        # 結果はワーカー数やスレッド/プロセスの違いに依存しない．
+        # processes=Trueの場合，funcはpickleできる(モジュールのトップレベルで定義された)関数にする．
+        call = self.calls
+        self.calls += 1
+        seqs = [np.random.SeedSequence(self.seed_seq.entropy,
+                                       spawn_key=self.seed_seq.spawn_key + (call, i))
+                for i in range(n_tasks)]
+        Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with Executor(self.n_workers) as pool:
+            return list(pool.map(_run_with_stream, [func] * n_tasks, seqs, range(n_tasks)))
+
+def _run_with_stream(func, seq, i):
+    return func(np.random.Generator(np.random.PCG64(seq)), i)
+
+
+# 2.3.1の例をGeneratorで書き直す．
+prng = ParallelRandom(0)
+values = prng.integers(1, 10, size=5)
+compute_reciprocals(values)
+
+# ワーカー数を変えても，同じシードからは同じ乱数列が得られる．
+a = ParallelRandom(42, n_workers=1).standard_normal(10**7)
+b = ParallelRandom(42, n_workers=8).standard_normal(10**7)
+print(np.array_equal(a, b))
+# True
+
+# 確保済みのバッファ(float32)に書き込む
+buf = np.empty((1000, 1000), dtype=np.float32)
+ParallelRandom(42).uniform(-1, 1, out=buf)
+
+# プロセスプールでのモンテカルロ法．タスクごとに独立したストリームを使う．
+def estimate_pi(rng, i, n=10**6):
+    xy = rng.random((n, 2))
+    return 4 * np.mean((xy ** 2).sum(1) < 1)
+
+if __name__ == '__main__':
+    print(np.mean(ParallelRandom(0).map(estimate_pi, 8, processes=True)))
+    # 3.1414...
+
+
+# 1e9個の正規乱数と一様乱数(float32, 4GB)を生成する速度を，1つのGeneratorと比較する．
+def benchmark_parallel_random(n=10**9, n_workers=None):
+    out = np.empty(n, dtype=np.float32)
+    g = np.random.default_rng(0)
+    prng = ParallelRandom(0, n_workers=n_workers)
+    for name, single, parallel in [
+            ('normal', lambda: g.standard_normal(out=out, dtype=np.float32),
+             lambda: prng.standard_normal(out=out, dtype=np.float32)),
+            ('uniform', lambda: g.random(out=out, dtype=np.float32),
+             lambda: prng.random(out=out, dtype=np.float32))]:
+        t0 = time.perf_counter()
+        single()
+        t_single = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        parallel()
+        t_par = time.perf_counter() - t0
+        print("{0:<7}: Generator {1:.2f} s ({2:.0f} M/s), ParallelRandom {3:.2f} s ({4:.0f} M/s)".format(
+            name, t_single, n / t_single / 1e6, t_par, n / t_par / 1e6))
+
+#benchmark_parallel_random()
\ No newline at end of file
@@ -148,4 +148,299 @@ z = np.sin(x)**10 + np.cos(10+y*x)*np.cos(x)
 import matplotlib.pyplot as plt
 plt.imshow(z, origin='lower', extent=[0, 5, 0, 5], cmap='viridis')
 plt.colorbar()
-plt.show()
\ No newline at end of file
+plt.show()
+
+
+
+
+
+# ------------------------------------------------------------------------------
+# ----- 2.5.4 発展：メモリ使用量を見積もるブロードキャストの計画と分割実行 -----
+# ------------------------------------------------------------------------------
+# ブロードキャストのルールに従っていても，結果が非常に大きな配列になることがある．
+# 例えば，2.8.3のX[:, np.newaxis, :] - X[np.newaxis, :, :]は，N点に対してN×N×Dの一時配列を作る．
+# そこで，式を実際には計算せずに，形状とdtypeだけを追跡して
+# 出力の形状と各中間結果(一時配列)のバイト数を見積もる．
+# 見積もりが上限(BROADCAST_BUDGET)を超える場合は，メモリを確保する前にエラーとするか，
+# ブロードキャストされない軸に沿って入力を分割し，分割ごとに計算する．
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+BROADCAST_BUDGET = 256 * 2**20   # 一時配列に使ってよいバイト数(デフォルト)
+
+def _is_basic_index(k):
+    # スライス，np.newaxis，Ellipsis，整数はビューを返す(ブール値はファンシーインデクスとして扱われる)
+    if isinstance(k, (bool, np.bool_)):
+        return False
+    return k is None or k is Ellipsis or isinstance(k, (slice, int, np.integer))
+
+def _matmul_shape(a, b):
+    # np.matmulの結果の形状．1次元の入力は行列に広げてから，追加した軸を取り除く．
+    if len(a) == 0 or len(b) == 0:
+        raise ValueError("matmul: input operand does not have enough dimensions")
+    a2 = (1,) + a if len(a) == 1 else a
+    b2 = b + (1,) if len(b) == 1 else b
+    if a2[-1] != b2[-2]:
+        raise ValueError("matmul: core dimension mismatch {0} (n?,k),(k,m?)->(n?,m?) with {1}".format(a, b))
+    shape = np.broadcast_shapes(a2[:-2], b2[:-2]) + (a2[-2], b2[-1])
+    if len(a) == 1:
+        shape = shape[:-2] + shape[-1:]
+    if len(b) == 1:
+        shape = shape[:-1]
+    return shape
+
+class _Meta(NDArrayOperatorsMixin):
+    # 形状とdtypeだけを持つ配列の代わり．演算を行うと，結果の形状とdtypeを計算してplanに記録する．
+    # 実際の計算で一時配列が解放されるのは，その配列への参照がなくなったとき．
+    # _Metaも同じように参照されなくなった時点で(__del__)，確保していたバイト数をplanから差し引く．
+    def __init__(self, shape, dtype, plan, base=None):
+        self.owns = False   # 計算の途中で確保された一時配列か(入力やビューはFalse)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.plan = plan
+        self.base = base    # ビューの場合は元の配列(ビューが残っている間は元の配列も解放されない)
+
+    def __del__(self):
+        if self.owns:
+            self.plan.live_bytes -= self.nbytes
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def _dummy(self):
+        # メモリを使わない，同じ形状とdtypeの配列(ストライド0)
+        return np.broadcast_to(np.zeros((), dtype=self.dtype), self.shape)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        metas = [v for v in inputs if isinstance(v, _Meta)]
+        # 要素1つの配列で実際に計算して，結果のdtypeを決める(スカラーはそのまま渡す)
+        small = [np.zeros((1,) * v.ndim, dtype=v.dtype) if isinstance(v, _Meta) else v for v in inputs]
+        if method == '__call__' and ufunc is np.matmul:
+            shape = _matmul_shape(*[np.shape(v) if not isinstance(v, _Meta) else v.shape
+                                    for v in inputs])
+            # dtypeだけが必要なので，1×1の行列どうしで計算する
+            dtypes = [v.dtype if isinstance(v, _Meta) else np.asarray(v).dtype for v in inputs]
+            result = ufunc(*[np.zeros((1, 1), dtype=dt) for dt in dtypes], **kwargs)
+        elif ufunc.signature is not None:
+            # matmul以外の一般化ufunc(np.vecdotなど)は要素ごとの演算ではない
+            raise TypeError("generalized ufunc np.{0} (signature {1}) is not supported by the planner".format(
+                ufunc.__name__, ufunc.signature))
+        elif method == '__call__':
+            shape = np.broadcast_shapes(*[np.shape(v) if not isinstance(v, _Meta) else v.shape
+                                          for v in inputs])
+            result = getattr(ufunc, method)(*small, **kwargs)
+        elif method == 'reduce':
+            axis = kwargs.get('axis', 0)
+            keepdims = kwargs.get('keepdims', False)
+            result = ufunc.reduce(small[0], **kwargs)
+            ndim = metas[0].ndim
+            axes = range(ndim) if axis is None else [a % ndim for a in np.atleast_1d(axis)]
+            shape = tuple(1 if i in axes else n for i, n in enumerate(metas[0].shape)
+                          if keepdims or i not in axes)
+        else:
+            raise TypeError("np.{0}.{1} is not supported by the planner; "
+                            "only element-wise calls and reduce are".format(ufunc.__name__, method))
+        results = result if isinstance(result, tuple) else (result,)
+        outs = [_Meta(shape, np.asarray(r).dtype, self.plan) for r in results]
+        self.plan._record(ufunc.__name__ + ('' if method == '__call__' else '.' + method), outs, metas)
+        return tuple(outs) if isinstance(result, tuple) else outs[0]
+
+    def __array_function__(self, func, types, args, kwargs):
+        # np.whereやnp.concatenateなどはufuncではないので，結果の形状を正しく追跡できない
+        raise TypeError("np.{0} is not supported by the planner; use ufuncs, reductions "
+                        "(sum, prod, min, max, mean) and indexing".format(func.__name__))
+
+    def __getattr__(self, name):
+        # ndarrayのメソッドのうち，対応していないもの(std，argmaxなど)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        raise AttributeError("ndarray.{0} is not supported by the planner; supported methods are "
+                             "sum, prod, min, max, mean, reshape and T".format(name))
+
+    def __getitem__(self, key):
+        # 基本的なインデクス(スライスやnp.newaxis)はビューなのでメモリを使わない．
+        # ファンシーインデクスはコピーを作るので一時配列として記録する．
+        items = key if isinstance(key, tuple) else (key,)
+        if any(isinstance(k, _Meta) for k in items):
+            # 計算結果によるマスクは，値が分からないと結果の形状が決まらない
+            raise TypeError("indexing with a computed boolean mask cannot be planned; "
+                            "the result shape depends on the values")
+        view = self._dummy()[key]
+        if all(_is_basic_index(k) for k in items):
+            return _Meta(view.shape, self.dtype, self.plan, base=self)
+        out = _Meta(view.shape, self.dtype, self.plan)
+        self.plan._record('getitem', [out], [self])
+        return out
+
+    def sum(self, axis=None, keepdims=False):
+        return np.add.reduce(self, axis=axis, keepdims=keepdims)
+
+    def prod(self, axis=None, keepdims=False):
+        return np.multiply.reduce(self, axis=axis, keepdims=keepdims)
+
+    def min(self, axis=None, keepdims=False):
+        return np.minimum.reduce(self, axis=axis, keepdims=keepdims)
+
+    def max(self, axis=None, keepdims=False):
+        return np.maximum.reduce(self, axis=axis, keepdims=keepdims)
+
+    def mean(self, axis=None, keepdims=False):
+        # np.meanは合計を求めた配列をその場で割るので，一時配列は合計の分だけ
+        dtype = np.float64 if self.dtype.kind in 'biu' else None
+        return np.add.reduce(self, axis=axis, keepdims=keepdims, dtype=dtype)
+
+    def reshape(self, *shape):
+        return _Meta(self._dummy().reshape(*shape).shape, self.dtype, self.plan, base=self)
+
+    @property
+    def T(self):
+        return _Meta(self.shape[::-1], self.dtype, self.plan, base=self)
+
+
+class BroadcastPlan:
+    # 出力の形状，dtypeと，各ステップで確保される一時配列の見積もり
+    def __init__(self):
+        self.steps = []        # (演算の名前, 形状, dtype, バイト数)
+        self.live_bytes = 0    # その時点で解放されずに残っている一時配列のバイト数
+        self.peak_bytes = 0    # 計算全体を通したlive_bytesの最大値(最終的な出力も含む)
+        self.shape = None
+        self.dtype = None
+
+    def _record(self, name, outs, inputs):
+        # 出力を確保した時点では，入力も含めてそれまでの一時配列がすべて残っている
+        for o in outs:
+            o.owns = True
+            self.live_bytes += o.nbytes
+            self.steps.append((name, o.shape, o.dtype, o.nbytes))
+        self.peak_bytes = max(self.peak_bytes, self.live_bytes)
+
+    def __repr__(self):
+        lines = ["{0:<16} {1:<20} {2:<8} {3:>12}".format('op', 'shape', 'dtype', 'bytes')]
+        for name, shape, dtype, nbytes in self.steps:
+            lines.append("{0:<16} {1:<20} {2:<8} {3:>12,}".format(name, str(shape), str(dtype), nbytes))
+        lines.append("output {0} {1}, peak {2:,} bytes".format(self.shape, self.dtype, self.peak_bytes))
+        return "\n".join(lines)
+
+def _describe(v):
+    # 配列か(shape, dtype)のタプルを形状とdtypeに変換する
+    if isinstance(v, tuple) and len(v) == 2 and isinstance(v[0], tuple):
+        return v
+    v = np.asarray(v)
+    return v.shape, v.dtype
+
+def plan_broadcast(expr, **operands):
+    # expr(**operands)を計算せずに，出力の形状と一時配列のバイト数を見積もる．
+    # operandsには配列か(shape, dtype)のタプルを渡す．
+    plan = BroadcastPlan()
+    metas = {name: _Meta(*_describe(v), plan) for name, v in operands.items()}
+    out = expr(**metas)
+    plan.shape, plan.dtype = out.shape, out.dtype
+    return plan
+
+def _chunk_axes(expr, operands, full):
+    # 入力nameの軸axisをk個に切ったとき，出力のちょうど1つの軸(out_axis)がkになる組を探す
+    candidates = []
+    for name, v in operands.items():
+        shape, dtype = _describe(v)
+        for axis, n in enumerate(shape):
+            if n < 2:
+                continue
+            ok = True
+            out_axis = None
+            for k in (1, 2):
+                sub = dict(operands)
+                sub[name] = (shape[:axis] + (k,) + shape[axis + 1:], dtype)
+                try:
+                    s = plan_broadcast(expr, **sub).shape
+                except ValueError:
+                    ok = False
+                    break
+                diff = [i for i in range(len(s)) if s[i] != full.shape[i]] if len(s) == len(full.shape) else None
+                if diff is None or len(diff) != 1 or s[diff[0]] != k or full.shape[diff[0]] != n:
+                    ok = False
+                    break
+                out_axis = diff[0]
+            if ok:
+                candidates.append((n, name, axis, out_axis))
+    return candidates
+
+def broadcast_eval(expr, budget=None, on_exceed='chunk', **operands):
+    # expr(**operands)を計算する．一時配列の見積もりがbudgetを超える場合，
+    # on_exceed='raise'ならメモリを確保する前にMemoryErrorとし，
+    # on_exceed='chunk'なら入力を分割して計算し，出力に書き込む．
+    if budget is None:
+        budget = BROADCAST_BUDGET
+    plan = plan_broadcast(expr, **operands)
+    if plan.peak_bytes <= budget:
+        return expr(**operands)
+    if on_exceed == 'raise':
+        raise MemoryError("expression needs {0:,} bytes of temporaries (budget {1:,})\n{2}".format(
+            plan.peak_bytes, budget, plan))
+    candidates = _chunk_axes(expr, operands, plan)
+    if not candidates:
+        raise MemoryError("expression exceeds the budget and has no axis to split along")
+    # 最も長い軸で分割する．一時配列のバイト数は分割の長さにほぼ比例する．
+    n, name, axis, out_axis = max(candidates, key=lambda c: c[0])
+    shape, dtype = _describe(operands[name])
+    k = max(1, n * budget // plan.peak_bytes)
+    while True:
+        sub = dict(operands)
+        sub[name] = (shape[:axis] + (k,) + shape[axis + 1:], dtype)
+        if plan_broadcast(expr, **sub).peak_bytes <= budget:
+            break
+        if k == 1:
+            raise MemoryError("a single slice along '{0}' axis {1} exceeds the budget".format(name, axis))
+        k = max(1, k // 2)
+    out = np.empty(plan.shape, dtype=plan.dtype)
+    src = np.asarray(operands[name])
+    for start in range(0, n, k):
+        sub = dict(operands)
+        sub[name] = src[(slice(None),) * axis + (slice(start, start + k),)]
+        out[(slice(None),) * out_axis + (slice(start, start + k),)] = expr(**sub)
+    return out
+
+
+# 2.5.3.2の2次元関数：xは(50,)，yは(50, 1)で，出力は(50, 50)になる．
+f = lambda x, y: np.sin(x)**10 + np.cos(10 + y*x)*np.cos(x)
+print(plan_broadcast(f, x=x, y=y))
+# op               shape                dtype           bytes
+# sin              (50,)                float64           400
+# power            (50,)                float64           400
+# multiply         (50, 50)             float64        20,000
+# add              (50, 50)             float64        20,000
+# cos              (50, 50)             float64        20,000
+# cos              (50,)                float64           400
+# multiply         (50, 50)             float64        20,000
+# add              (50, 50)             float64        20,000
+# output (50, 50) float64, peak 40,800 bytes
+
+# 2000×2000の格子では一時配列が32MBずつになるので，上限を8MBにすると行ごとに分割して計算される．
+x2 = np.linspace(0, 5, 2000)
+y2 = np.linspace(0, 5, 2000)[:, np.newaxis]
+z2 = broadcast_eval(f, budget=8 * 2**20, x=x2, y=y2)
+print(np.allclose(z2, f(x2, y2)))
+# True
+
+# 2.8.3の距離の計算．同じXを2つの入力AとBとして渡すと，Aの点の方向に分割できる．
+dist = lambda A, B: ((A[:, np.newaxis, :] - B[np.newaxis, :, :]) ** 2).sum(-1)
+X = np.random.RandomState(42).rand(1000, 2)
+print(plan_broadcast(dist, A=X, B=X).peak_bytes)
+# 32000000
+# broadcast_eval(dist, budget=4 * 2**20, on_exceed='raise', A=X, B=X)   # MemoryError
+dist_sq = broadcast_eval(dist, budget=4 * 2**20, A=X, B=X)
+print(np.allclose(dist_sq, dist(X, X)))
+# True
+
+# 複数の中間結果が同時に残る式では，それらの合計が最大値になる．
+# exp(a-b)，sin(a*b)，a+bが残ったままcos(a+b)を確保する時点で，8MBの配列が4つになる．
+g = lambda a, b: np.exp(a - b) + np.sin(a * b) * np.cos(a + b)
+print(plan_broadcast(g, a=((1000, 1), 'f8'), b=((1, 1000), 'f8')).peak_bytes)
+# 32000000   (tracemallocで測った実際の最大値は32000384)
+
+# 形状だけを渡して，確保する前に100万点の場合を見積もることもできる．
+plan_broadcast(dist, A=((10**6, 2), 'f8'), B=((10**6, 2), 'f8')).peak_bytes
+# 32000000000000   (32TB)
\ No newline at end of file
@@ -159,4 +159,126 @@ print("Median precip on non-summer rainy days (inches) : ", np.median(inches[rai
 
 # andとorはオブジェクト全体に対して1つの真偽値を評価する場合に使用し，
 # &と|はオブジェクトの内容(それぞれのビットやバイト)に対する複数の真偽値を評価する場合に使用する．
-# NumPy配列に対するブール式の評価に適しているのは，ほぼ常に後者．
\ No newline at end of file
+# NumPy配列に対するブール式の評価に適しているのは，ほぼ常に後者．
+
+
+
+
+
+# ---------------------------------------------------------------------------------
+# ----- 2.6.5 発展：ブロックごとに評価して途中で打ち切るany/all/count_nonzero -----
+# ---------------------------------------------------------------------------------
+# 2.6.3.1のnp.any(x > 8)は，まずx > 8を配列全体について計算してブール値配列を作り，それから集約する．
+# 最初の数要素で答えが決まる場合でも，比較はすべての要素に対して行われ，xと同じ要素数の一時配列も必要になる．
+# そこで，比較をブロックごとに行い，anyは最初のTrue，allは最初のFalseが見つかった時点で打ち切る．
+# 条件は関数(predicate)として渡す．入力には配列(np.memmapを含む)か，チャンクを順に返すイテラブルを使える．
+# 配列の場合は先頭のブロックを小さくし，ブロックを倍々に大きくしていく．
+# こうすると，すぐに答えが決まる場合は速く，最後まで調べる場合もブロックごとのオーバーヘッドは小さい．
+import time
+
+def _iter_blocks(x, block):
+    # 配列は軸0に沿ってブロックに分け，イテラブルはそのままチャンクを返す
+    if not isinstance(x, np.ndarray):
+        for chunk in x:
+            yield np.asarray(chunk)
+        return
+    row = max(1, int(np.prod(x.shape[1:])))
+    start, step = 0, max(1, 4096 // row)
+    max_step = max(1, block // row)
+    while start < x.shape[0]:
+        yield x[start:start + step]
+        start += step
+        step = min(2 * step, max_step)
+
+def _chunked_reduce(pred, x, axis, block, kind):
+    # kindは'any'，'all'，'count'のいずれか
+    if kind == 'count':
+        reduce = lambda m, ax: np.count_nonzero(m, axis=ax)
+        combine, stop = np.add, None
+    elif kind == 'any':
+        reduce, combine, stop = np.any, np.logical_or, True
+    else:
+        reduce, combine, stop = np.all, np.logical_and, False
+    if isinstance(x, np.ndarray) and x.size == 0:
+        # 要素が1つもない場合はnp.any，np.all，np.count_nonzeroと同じ値
+        return reduce(pred(x), axis)
+    acc = None
+    parts = []
+    for chunk in _iter_blocks(x, block):
+        if axis is not None and axis < 0:
+            axis += chunk.ndim
+        if axis is None or axis == 0:
+            # ブロック間で集約する(axis=Noneならスカラー，axis=0なら1行分の配列)
+            part = reduce(pred(chunk), axis)
+            acc = part if acc is None else combine(acc, part)
+            if stop is not None and np.all(acc == stop):
+                return acc
+        else:
+            # 各ブロックの中で集約し，軸0に沿って結合する
+            parts.append(reduce(pred(chunk), axis))
+    if axis is not None and axis != 0:
+        return np.concatenate(parts)
+    if acc is None:
+        # 空のイテラブル
+        acc = 0 if kind == 'count' else (kind == 'all')
+    return acc
+
+def chunked_any(pred, x, axis=None, block=2**18):
+    return _chunked_reduce(pred, x, axis, block, 'any')
+
+def chunked_all(pred, x, axis=None, block=2**18):
+    return _chunked_reduce(pred, x, axis, block, 'all')
+
+def chunked_count_nonzero(pred, x, axis=None, block=2**18):
+    return _chunked_reduce(pred, x, axis, block, 'count')
+
+
+# 2.6.3.1と同じ結果になる．
+x = np.array([[5, 0, 3, 3],
+              [7, 9, 3, 5],
+              [2, 4, 7, 6]])
+chunked_count_nonzero(lambda v: v < 6, x)
+# 8
+chunked_any(lambda v: v > 8, x)
+# True
+chunked_all(lambda v: v < 10, x)
+# True
+chunked_all(lambda v: v < 8, x, axis=1)
+# array([ True, False,  True])
+
+# チャンクを順に返すジェネレータにも使える．
+# 例えば，2.6.1の降水量を1日ずつ読み込む場合でも，最初の雨の日が見つかった時点で読み込みを止める．
+def daily(values):
+    for i, v in enumerate(values):
+        print("read day", i)
+        yield [v]
+
+chunked_any(lambda v: v > 0, daily([0.0, 0.0, 0.3, 0.0, 0.1]))
+# read day 0
+# read day 1
+# read day 2
+# True
+
+
+# 1e9要素(1GB)の配列について，np.any(x > 0)と比較する．
+# best  : 先頭の要素が条件を満たす
+# worst : どの要素も満たさない(最後まで調べる必要がある)
+# random: ランダムな位置の1要素だけが満たす
+def benchmark_chunked_any(n=10**9):
+    x = np.zeros(n, dtype=np.int8)
+    rng = np.random.RandomState(0)
+    for case, pos in [('best', 0), ('worst', None), ('random', rng.randint(n))]:
+        if pos is not None:
+            x[pos] = 1
+        t0 = time.perf_counter()
+        expected = np.any(x > 0)
+        t_numpy = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        result = chunked_any(lambda v: v > 0, x)
+        t_chunk = time.perf_counter() - t0
+        print("{0:<6}: np.any {1:.3f} s, chunked_any {2:.4f} s, equal={3}".format(
+            case, t_numpy, t_chunk, expected == result))
+        if pos is not None:
+            x[pos] = 0
+
+#benchmark_chunked_any()
\ No newline at end of file
@@ -150,4 +150,610 @@ plt.show()
 
 # この方法で使用したブロードキャストと行単位のソートは，
 # ループを書くよりも自然ではないかもしれない．
-# しかし，Pythonでデータ操作を行うなら，この方法が結局は効率的．
\ No newline at end of file
+# しかし，Pythonでデータ操作を行うなら，この方法が結局は効率的．
+
+
+
+
+
+# ------------------------------------------------------------------
+# ----- 2.8.4 発展：メモリに収まらない配列のソート(外部マージソート) -----
+# ------------------------------------------------------------------
+# np.sortやnp.argsortは配列全体がメモリ上にあることを前提としている．
+# ソートしたいキーがメモリに収まらない場合は，次の2段階で処理する(外部マージソート)．
+#   1. 入力をメモリ予算に収まる長さ(ラン)に分割し，スレッドプール上でそれぞれnp.sort/np.argsortする．
+#      NumPyのソートはGILを解放するので，複数のランを並列にソートできる．
+#   2. ソート済みのランをk-wayマージしてmemmapに書き出す．
+#      各ランからブロックを読み込み，「これ以下の値はもう現れない」しきい値までをまとめて
+#      安定ソートすることで，要素ごとのPythonループを使わずにマージする．
+# 入力は1次元のndarray/np.memmap，またはチャンク(1次元配列)を返すイテラブルとする．
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def external_sort(src, out, argsort_out=None, payload=None, payload_out=None,
+                  memory_budget=256 * 2**20, n_workers=4, tmpdir=None):
+    # srcを昇順に安定ソートしてoutに書き込む．
+    # argsort_outを渡すと，大域的なソート順(np.argsort(src, kind='stable')と同じ)を書き込む．
+    # payloadを渡すと，キーと同じ順に並べ替えてpayload_outに書き込む．
+    # メモリ使用量はおおよそmemory_budgetバイトに収まる．
+    # 戻り値は読み書きしたバイト数などの統計情報．
+    need_perm = argsort_out is not None or payload is not None
+    io = dict(bytes_read=0, bytes_written=0, n_runs=0)
+
+    # 1要素あたりに扱うバイト数(キー + ソート順 + ペイロード)
+    rec_bytes = out.dtype.itemsize
+    if need_perm:
+        rec_bytes += 8
+    if payload is not None:
+        rec_bytes += payload.dtype.itemsize
+
+    # 1ランあたり，コピー・ソート結果・作業領域でおよそ3倍のメモリを使う
+    run_len = max(1, memory_budget // (3 * rec_bytes * n_workers))
+    if hasattr(src, 'shape'):
+        n = src.shape[0]
+        chunks = ((start, src[start:start + run_len])
+                  for start in range(0, n, run_len))
+    else:
+        # チャンクのイテラブルは，run_lenより長いチャンクを分割してランにする
+        def _chunks(iterable):
+            start = 0
+            for chunk in iterable:
+                chunk = np.asarray(chunk)
+                for i in range(0, chunk.shape[0], run_len):
+                    piece = chunk[i:i + run_len]
+                    yield start, piece
+                    start += piece.shape[0]
+        chunks = _chunks(src)
+        n = out.shape[0]
+    if n == 0:
+        return io
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as d:
+        runs_key = np.memmap(os.path.join(d, 'key'), dtype=out.dtype, mode='w+', shape=(n,))
+        runs_perm = (np.memmap(os.path.join(d, 'perm'), dtype=np.int64, mode='w+', shape=(n,))
+                     if need_perm else None)
+        runs_pay = (np.memmap(os.path.join(d, 'payload'), dtype=payload.dtype, mode='w+', shape=(n,))
+                    if payload is not None else None)
+
+        # ----- 1. ランの並列ソート -----
+        def sort_run(start, chunk):
+            chunk = np.array(chunk, dtype=out.dtype)
+            stop = start + chunk.shape[0]
+            if need_perm:
+                order = np.argsort(chunk, kind='stable')
+                runs_key[start:stop] = chunk[order]
+                runs_perm[start:stop] = order + start
+                if payload is not None:
+                    runs_pay[start:stop] = np.asarray(payload[start:stop])[order]
+            else:
+                chunk.sort(kind='stable')
+                runs_key[start:stop] = chunk
+            return start, stop
+
+        bounds = []
+        with ThreadPoolExecutor(n_workers) as pool:
+            pending = []
+            for start, chunk in chunks:
+                pending.append(pool.submit(sort_run, start, chunk))
+                # 同時に保持するランの数をワーカー数程度に抑える
+                if len(pending) >= 2 * n_workers:
+                    bounds.append(pending.pop(0).result())
+            bounds += [f.result() for f in pending]
+        bounds.sort()
+        io['n_runs'] = len(bounds)
+        io['bytes_read'] += n * rec_bytes      # 入力の読み込み
+        io['bytes_written'] += n * rec_bytes   # ランの書き出し
+
+        # ----- 2. k-wayマージ -----
+        k = len(bounds)
+        block = max(1, memory_budget // (k * (3 * rec_bytes + 8)))
+        cursor = [start for start, stop in bounds]    # 次に読み込む位置
+        buf_key = [np.empty(0, out.dtype)] * k        # 読み込み済みで未出力の要素
+        buf_perm = [np.empty(0, np.int64)] * k
+        buf_pay = [np.empty(0, payload.dtype) if payload is not None else None] * k
+        pos = 0
+        while pos < n:
+            # 空になったバッファを補充する
+            for r, (start, stop) in enumerate(bounds):
+                if buf_key[r].shape[0] == 0 and cursor[r] < stop:
+                    end = min(cursor[r] + block, stop)
+                    buf_key[r] = np.array(runs_key[cursor[r]:end])
+                    if need_perm:
+                        buf_perm[r] = np.array(runs_perm[cursor[r]:end])
+                    if payload is not None:
+                        buf_pay[r] = np.array(runs_pay[cursor[r]:end])
+                    io['bytes_read'] += (end - cursor[r]) * rec_bytes
+                    cursor[r] = end
+
+            # まだ読み込んでいない要素を持つランのうち，バッファ末尾の値が最小のもの．
+            # しきい値tより小さい値はこの先どのランからも現れない．
+            pending = [r for r, (start, stop) in enumerate(bounds) if cursor[r] < stop]
+            if pending:
+                # NaNとの比較は常にFalseになるので，Pythonのminではなく，
+                # np.sortと同じくNaNを最後に並べる安定ソートで最小のものを選ぶ．
+                last = np.array([buf_key[r][-1] for r in pending])
+                first = np.argsort(last, kind='stable')[0]
+                t = last[first]
+                # tと等しい値がまだ残っている最初のラン．
+                # 安定性のため，それより後ろのランのtと等しい値は次の回に回す．
+                r_star = pending[first]
+                cut = [np.searchsorted(buf_key[r], t, side='right' if r <= r_star else 'left')
+                       for r in range(k)]
+            else:
+                cut = [buf_key[r].shape[0] for r in range(k)]
+
+            # ランの順に連結して安定ソートすれば，全体としても安定なマージになる
+            keys = np.concatenate([buf_key[r][:cut[r]] for r in range(k)])
+            order = np.argsort(keys, kind='stable')
+            m = keys.shape[0]
+            out[pos:pos + m] = keys[order]
+            if need_perm:
+                perm = np.concatenate([buf_perm[r][:cut[r]] for r in range(k)])[order]
+                if argsort_out is not None:
+                    argsort_out[pos:pos + m] = perm
+                if payload is not None:
+                    pay = np.concatenate([buf_pay[r][:cut[r]] for r in range(k)])
+                    payload_out[pos:pos + m] = pay[order]
+            io['bytes_written'] += m * rec_bytes
+            pos += m
+
+            for r in range(k):
+                buf_key[r] = buf_key[r][cut[r]:]
+                if need_perm:
+                    buf_perm[r] = buf_perm[r][cut[r]:]
+                if payload is not None:
+                    buf_pay[r] = buf_pay[r][cut[r]:]
+
+        del runs_key, runs_perm, runs_pay
+    return io
+
+
+# 小さな配列でnp.sort，np.argsortの結果と一致することを確認する．
+x = rand.randint(0, 100, 100000)
+sorted_x = np.empty_like(x)
+perm = np.empty(x.shape[0], dtype=np.int64)
+external_sort(x, sorted_x, argsort_out=perm, memory_budget=2**22)
+print(np.array_equal(sorted_x, np.sort(x)))
+print(np.array_equal(perm, np.argsort(x, kind='stable')))
+# True
+# True
+
+# NaNを含む場合も，np.sortと同じくNaNは最後に並ぶ．
+xf = rand.rand(100000)
+xf[rand.rand(xf.size) < 0.01] = np.nan
+sorted_xf = np.empty_like(xf)
+perm_f = np.empty(xf.shape[0], dtype=np.int64)
+external_sort(xf, sorted_xf, argsort_out=perm_f, memory_budget=2**22)
+print(np.array_equal(sorted_xf, np.sort(xf), equal_nan=True))
+print(np.array_equal(perm_f, np.argsort(xf, kind='stable')))
+# True
+# True
+
+# チャンクのイテラブルも入力にできる．
+external_sort(np.array_split(x, 7), sorted_x, memory_budget=2**22)
+print(np.array_equal(sorted_x, np.sort(x)))
+# True
+
+
+# メモリ予算の2倍，4倍，10倍の入力で，スループットとディスクI/O量を計測する．
+# (実運用ではmemory_budgetを物理メモリ量にして，同じ比率の入力を用いる．)
+def benchmark_external_sort(memory_budget=2**24, ratios=(2, 4, 10), dtype='f8'):
+    with tempfile.TemporaryDirectory() as d:
+        for ratio in ratios:
+            n = ratio * memory_budget // np.dtype(dtype).itemsize
+            src = np.memmap(os.path.join(d, 'src'), dtype=dtype, mode='w+', shape=(n,))
+            src[:] = rand.rand(n)
+            out = np.memmap(os.path.join(d, 'out'), dtype=dtype, mode='w+', shape=(n,))
+            t0 = time.perf_counter()
+            io = external_sort(src, out, memory_budget=memory_budget)
+            elapsed = time.perf_counter() - t0
+            print("{0:>3}x budget: {1:.1f} Melem/s, read {2:.0f} MB, written {3:.0f} MB, {4} runs".format(
+                ratio, n / elapsed / 1e6, io['bytes_read'] / 2**20, io['bytes_written'] / 2**20, io['n_runs']))
+            del src, out
+
+#benchmark_external_sort()
+
+
+
+
+
+# -------------------------------------------------------
+# ----- 2.8.5 発展：ストリーミングと並列処理によるtop-k選択 -----
+# -------------------------------------------------------
+# 2.8.2のnp.partitionや2.8.3のnp.argpartitionは，配列全体がメモリ上にあることを前提としている．
+# しかし，K個の最小値を求めるだけなら，全体を一度に持つ必要はない．
+#   ・チャンクごとにnp.argpartitionでK個の候補を選ぶ．
+#   ・K個の候補同士を連結して再びnp.argpartitionすれば，2つの部分結果をマージできる．
+# この性質を使えば，ストリーム，memmap，並列ワーカーの部分結果のいずれにも対応できる．
+# 戻り値は値と(配列全体における)インデクスの組で，値の昇順に並べる．
+
+def _select(values, k, largest):
+    # 最小(または最大)のk個の位置を返す(順不同)．
+    # 境界の値が重複している場合は，np.argsort(kind='stable')と同じく前にある要素を優先する．
+    # NaNはnp.sortやnp.partitionと同じく，どの値よりも大きいものとして扱う．
+    n = values.shape[-1]
+    if k <= 0:
+        return np.empty(values.shape[:-1] + (0,), dtype=np.intp)
+    if k >= n:
+        return np.broadcast_to(np.arange(n), values.shape)
+    kth = n - k if largest else k - 1
+    thr = np.partition(values, kth, axis=-1)[..., kth:kth + 1]
+    if values.dtype.kind == 'f':
+        nan, thr_nan = np.isnan(values), np.isnan(thr)
+        if largest:
+            inside = (values > thr) | (nan & ~thr_nan)
+        else:
+            inside = (values < thr) | (~nan & thr_nan)
+        ties = (values == thr) | (nan & thr_nan)
+    else:
+        inside = values > thr if largest else values < thr
+        ties = values == thr
+    need = k - inside.sum(-1, keepdims=True)
+    keep = inside | (ties & (np.cumsum(ties, axis=-1) <= need))
+    return np.nonzero(keep)[-1].reshape(values.shape[:-1] + (k,))
+
+def _sorted_result(values, indices, largest):
+    # 値の順(同じ値ならインデクスの小さい順)に並べる
+    if largest:
+        order = np.lexsort((-indices, values), axis=-1)[..., ::-1]
+    else:
+        order = np.lexsort((indices, values), axis=-1)
+    return (np.take_along_axis(values, order, axis=-1),
+            np.take_along_axis(indices, order, axis=-1))
+
+def merge_topk(a, b, k, largest=False):
+    # 2つの部分結果(値, インデクス)をマージしてk個に絞る．
+    # 候補は高々2k個なので，インデクスも含めてソートしてしまえばよい．
+    values = np.concatenate([a[0], b[0]], axis=-1)
+    indices = np.concatenate([a[1], b[1]], axis=-1)
+    values, indices = _sorted_result(values, indices, largest)
+    return values[..., :k], indices[..., :k]
+
+
+class StreamingTopK:
+    # チャンクを順に受け取り，大きさkの候補バッファを保持する．
+    # 2次元のチャンク(タイル)を渡すと，各行ごと(axis=1)のtop-kを求める．
+    # offsetはチャンクの先頭要素(2次元なら先頭列)の大域的なインデクス．
+    def __init__(self, k, largest=False):
+        if k < 0:
+            raise ValueError("k must be non-negative, got {0}".format(k))
+        self.k = k
+        self.largest = largest
+        self.values = None
+        self.indices = None
+        self.offset = 0
+
+    def update(self, chunk, offset=None):
+        chunk = np.asarray(chunk)
+        if offset is None:
+            offset = self.offset
+        self.offset = offset + chunk.shape[-1]
+        sel = _select(chunk, self.k, self.largest)
+        part = (np.take_along_axis(chunk, sel, axis=-1), sel + offset)
+        if self.values is None:
+            self.values, self.indices = part
+        else:
+            self.values, self.indices = merge_topk((self.values, self.indices), part,
+                                                   self.k, self.largest)
+        return self
+
+    def merge(self, other):
+        # 別のワーカーが持つ部分結果を取り込む
+        if other.values is not None:
+            self.update_partial(other.values, other.indices)
+        return self
+
+    def update_partial(self, values, indices):
+        if self.values is None:
+            self.values, self.indices = values, indices
+        else:
+            self.values, self.indices = merge_topk((self.values, self.indices), (values, indices),
+                                                   self.k, self.largest)
+
+    def result(self):
+        # まだ何も受け取っていなければ空の結果を返す
+        if self.values is None:
+            return np.empty(0), np.empty(0, dtype=np.intp)
+        return _sorted_result(self.values, self.indices, self.largest)
+
+
+def topk(x, k, largest=False, chunk_size=2**20, n_workers=4):
+    # 1次元の配列(np.memmapを含む)からk個の最小値(最大値)とそのインデクスを求める．
+    # チャンクをスレッドプールで並列に処理し，部分結果をマージする．
+    # kが要素数より大きい場合は，全要素をソートして返す．
+    n = x.shape[0]
+    if n == 0 or k == 0:
+        return np.asarray(x[:0]).copy(), np.empty(0, dtype=np.intp)
+    def work(start):
+        return StreamingTopK(k, largest).update(x[start:start + chunk_size], offset=start)
+    with ThreadPoolExecutor(n_workers) as pool:
+        parts = list(pool.map(work, range(0, n, chunk_size)))
+    total = StreamingTopK(k, largest)
+    for part in parts:
+        total.merge(part)
+    return total.result()
+
+def topk_rows(X, k, largest=False, row_block=4096, n_workers=4):
+    # 2次元配列の各行(axis=1)についてtop-kを求める．行のブロックを並列に処理する．
+    values = np.empty((X.shape[0], min(k, X.shape[1])), dtype=X.dtype)
+    indices = np.empty(values.shape, dtype=np.intp)
+    def work(start):
+        stop = start + row_block
+        block = np.asarray(X[start:stop])
+        sel = _select(block, k, largest)
+        values[start:stop], indices[start:stop] = _sorted_result(
+            np.take_along_axis(block, sel, axis=-1), sel, largest)
+    with ThreadPoolExecutor(n_workers) as pool:
+        list(pool.map(work, range(0, X.shape[0], row_block)))
+    return values, indices
+
+
+# 2.8.2の例と同じ結果が得られる．
+x = np.array([7, 2, 3, 1, 6, 5, 4])
+topk(x, 3, chunk_size=2)
+# (array([1, 2, 3]), array([3, 1, 2]))
+
+# ストリームとして与える場合
+stream = StreamingTopK(3)
+for chunk in np.array_split(x, 3):
+    stream.update(chunk)
+stream.result()
+# (array([1, 2, 3]), array([3, 1, 2]))
+
+# NaNはnp.sortと同じく最大の値として扱われる．
+y = np.array([3., np.nan, 1., 2.])
+topk(y, 2, largest=True)
+# (array([nan,  3.]), array([1, 0]))
+topk(y, 4)
+# (array([ 1.,  2.,  3., nan]), array([2, 3, 0, 1]))
+
+# 2.8.3のk近傍法では，距離行列全体を作らずに，列方向のタイルごとに最近傍の候補を更新できる．
+X = rand.rand(1000, 2)
+K = 2
+knn = StreamingTopK(K + 1)
+for start in range(0, X.shape[0], 256):
+    tile = ((X[:, np.newaxis, :] - X[np.newaxis, start:start + 256, :]) ** 2).sum(-1)
+    knn.update(tile, offset=start)
+dist_k, nearest_k = knn.result()
+
+# 距離行列全体に対するnp.argsortの結果と一致する．
+dist_sq = ((X[:, np.newaxis, :] - X[np.newaxis, :, :]) ** 2).sum(-1)
+print(np.array_equal(nearest_k, np.argsort(dist_sq, axis=1, kind='stable')[:, :K + 1]))
+print(np.array_equal(topk_rows(dist_sq, K + 1)[1], nearest_k))
+# True
+# True
+
+
+# kを10から1e5まで変えて，np.argsortによる全体ソートと比較する．
+def benchmark_topk(n=10**7, ks=(10, 100, 1000, 10**4, 10**5)):
+    x = rand.rand(n)
+    t0 = time.perf_counter()
+    np.argsort(x)
+    t_sort = time.perf_counter() - t0
+    for k in ks:
+        t0 = time.perf_counter()
+        topk(x, k)
+        t_topk = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        np.argpartition(x, k)
+        t_part = time.perf_counter() - t0
+        print("k={0:>6}: topk {1:.3f} s, argpartition {2:.3f} s, argsort {3:.3f} s".format(
+            k, t_topk, t_part, t_sort))
+
+#benchmark_topk()
+
+
+
+
+
+# -------------------------------------------------------
+# ----- 2.8.6 発展：行(列)ごとのソートをマルチスレッドで行う -----
+# -------------------------------------------------------
+# 2.8.1.1のnp.sort(X, axis=0)，np.sort(X, axis=1)や2.8.3のnp.argsort(dist_sq, axis=1)は，
+# 1つのCPUコアしか使わない．
+# しかし，axisに沿ったソートでは各行(各列)は互いに独立しており，
+# NumPyはソートのループ中にGILを解放するので，行(列)のブロックをスレッドに分けて処理すれば並列化できる．
+# 各行に対して行う処理はNumPyと同じなので，結果もNumPyと完全に一致する．
+def _parallel_along_axis(func, X, axis, out, n_workers, block):
+    # axisを最後の軸に移動したビューを作り，先頭の軸に沿ってブロックに分けてfuncを適用する．
+    # funcは(入力ブロック, 出力ブロック)を受け取り，出力ブロックに結果を書き込む．
+    Xm = np.moveaxis(X, axis, -1)
+    outm = np.moveaxis(out, axis, -1)
+    if Xm.ndim == 1:
+        func(Xm, outm)
+        return out
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if block is None:
+        block = max(1, -(-Xm.shape[0] // (4 * n_workers)))
+    def work(start):
+        func(Xm[start:start + block], outm[start:start + block])
+    with ThreadPoolExecutor(n_workers) as pool:
+        list(pool.map(work, range(0, Xm.shape[0], block)))
+    return out
+
+def parallel_sort(X, axis=-1, kind=None, out=None, n_workers=None, block=None):
+    # np.sort(X, axis)と同じ結果をoutに書き込む．out=Xとすればその場でソートする．
+    if out is None:
+        out = np.empty_like(X)
+    inplace = out is X
+    def func(x, o):
+        if not inplace:
+            o[...] = x
+        o.sort(axis=-1, kind=kind)
+    return _parallel_along_axis(func, X, axis, out, n_workers, block)
+
+def parallel_argsort(X, axis=-1, kind=None, out=None, n_workers=None, block=None):
+    # np.argsort(X, axis)と同じ結果をoutに書き込む．
+    if out is None:
+        out = np.empty(X.shape, dtype=np.intp)
+    def func(x, o):
+        o[...] = np.argsort(x, axis=-1, kind=kind)
+    return _parallel_along_axis(func, X, axis, out, n_workers, block)
+
+def parallel_partition(X, kth, axis=-1, out=None, n_workers=None, block=None):
+    # np.partition(X, kth, axis)と同じ結果をoutに書き込む．out=Xとすればその場で分割する．
+    if out is None:
+        out = np.empty_like(X)
+    inplace = out is X
+    def func(x, o):
+        if not inplace:
+            o[...] = x
+        o.partition(kth, axis=-1)
+    return _parallel_along_axis(func, X, axis, out, n_workers, block)
+
+def parallel_argpartition(X, kth, axis=-1, out=None, n_workers=None, block=None):
+    # np.argpartition(X, kth, axis)と同じ結果をoutに書き込む．
+    if out is None:
+        out = np.empty(X.shape, dtype=np.intp)
+    def func(x, o):
+        o[...] = np.argpartition(x, kth, axis=-1)
+    return _parallel_along_axis(func, X, axis, out, n_workers, block)
+
+
+# 2.8.1.1の例と同じ結果が得られる．
+X = rand.randint(0, 10, (4, 6))
+print(np.array_equal(parallel_sort(X, axis=0), np.sort(X, axis=0)))
+print(np.array_equal(parallel_sort(X, axis=1), np.sort(X, axis=1)))
+print(np.array_equal(parallel_argsort(dist_sq, axis=1), np.argsort(dist_sq, axis=1)))
+print(np.array_equal(parallel_argpartition(dist_sq, K + 1, axis=1),
+                     np.argpartition(dist_sq, K + 1, axis=1)))
+# True
+# True
+# True
+# True
+
+# 事前に確保した配列に書き込んだり，その場でソートしたりできる．
+nearest = np.empty(dist_sq.shape, dtype=np.intp)
+parallel_argsort(dist_sq, axis=1, out=nearest)
+parallel_sort(X, axis=1, out=X)
+
+
+# スレッド数を1から32まで変えて，スケーリングを測定する．
+def benchmark_parallel_sort(shape=(10**5, 1000), threads=(1, 2, 4, 8, 16, 32)):
+    X = rand.rand(*shape)
+    out = np.empty_like(X)
+    t0 = time.perf_counter()
+    np.sort(X, axis=1)
+    t_numpy = time.perf_counter() - t0
+    print("np.sort: {0:.3f} s".format(t_numpy))
+    for n in threads:
+        t0 = time.perf_counter()
+        parallel_sort(X, axis=1, out=out, n_workers=n)
+        elapsed = time.perf_counter() - t0
+        print("{0:>2} threads: {1:.3f} s (x{2:.1f})".format(n, elapsed, t_numpy / elapsed))
+
+#benchmark_parallel_sort()
+
+
+
+
+
+# -----------------------------------------------------------
+# ----- 2.8.7 発展：整数キーに対する計数ソートと基数ソート -----
+# -----------------------------------------------------------
+# 年齢(2.9のage)，月や日(births.csvのmonth/day)，順番(president_heights.csvのorder)のように，
+# 値の範囲が狭い整数キーに汎用の比較ソートを使うのは大げさ．
+#   ・範囲が狭い場合は計数ソート：np.bincountで各値の個数を数え，np.repeatで並べるだけ(O(n + 範囲))．
+#   ・範囲が広い整数は16ビットずつのLSD基数ソート：下位の桁から順に安定ソートを繰り返す．
+# NumPyの安定ソート(kind='stable')は16ビット以下の整数に対しては基数ソートを使うので，
+# キーから最小値を引いてuint8/uint16に詰め直せば，各桁の安定ソートはO(n)で行える．
+def key_sort(keys, max_range=2**20):
+    # 整数キーをソートした配列を返す．範囲が狭ければ計数ソートを使う．
+    keys = np.asarray(keys)
+    if keys.dtype.kind not in 'iub' or keys.size == 0:
+        return np.sort(keys, kind='stable')
+    lo, hi = int(keys.min()), int(keys.max())
+    if hi - lo >= max_range:
+        return keys[key_argsort(keys)]
+    counts = np.bincount(_key_offset(keys, lo).astype(np.intp), minlength=hi - lo + 1)
+    return np.repeat(np.arange(lo, hi + 1).astype(keys.dtype), counts)
+
+def _key_offset(keys, lo):
+    # keys - loをuint64で返す．int8などの狭い型のまま引くとあふれるので，先に64ビットに広げる．
+    if keys.dtype.kind == 'u':
+        return keys.astype(np.uint64) - np.uint64(lo)
+    return (keys.astype(np.int64) - lo).astype(np.uint64)
+
+def key_argsort(keys):
+    # np.argsort(keys, kind='stable')と同じ並べ替えの順序を返す．
+    keys = np.asarray(keys)
+    if keys.dtype.kind not in 'iub' or keys.size == 0:
+        return np.argsort(keys, kind='stable')
+    lo, hi = int(keys.min()), int(keys.max())
+    span = hi - lo
+    # 最小値を引いて非負の整数にする
+    offset = _key_offset(keys, lo)
+    if span < 2**8:
+        return np.argsort(offset.astype(np.uint8), kind='stable')
+    if span < 2**16:
+        return np.argsort(offset.astype(np.uint16), kind='stable')
+    # LSD基数ソート：下位16ビットから順に安定ソートする
+    perm = np.argsort((offset & np.uint64(0xFFFF)).astype(np.uint16), kind='stable')
+    shift = 16
+    while span >> shift:
+        digit = ((offset[perm] >> np.uint64(shift)) & np.uint64(0xFFFF)).astype(np.uint16)
+        perm = perm[np.argsort(digit, kind='stable')]
+        shift += 16
+    return perm
+
+def struct_lexsort(data, fields):
+    # 構造化配列dataを，fieldsの先頭のフィールドを第1キーとして安定にソートする順序を返す．
+    # レコード自体はコピーせず，フィールドのビューから1列ずつ取り出してソートする．
+    # 結果は np.lexsort([data[f] for f in reversed(fields)]) と一致する．
+    if isinstance(fields, str):
+        fields = [fields]
+    perm = np.arange(data.shape[0])
+    for field in reversed(fields):
+        perm = perm[key_argsort(data[field][perm])]
+    return perm
+
+
+# 2.9と同じ構造化配列で試す．
+data = np.zeros(4, dtype={'names':('name', 'age', 'weight'),
+                          'formats':('U10', 'i4', 'f8')})
+data['name']   = ['Alice', 'Bob', 'Cathy', 'Doug']
+data['age']    = [25, 45, 37, 19]
+data['weight'] = [55.0, 85.5, 68.0, 61.5]
+
+i = struct_lexsort(data, ['age', 'weight'])
+print(i)
+print(data[i]['name'])
+# [3 0 2 1]
+# ['Doug' 'Alice' 'Cathy' 'Bob']
+
+key_sort(data['age'])
+# array([19, 25, 37, 45], dtype=int32)
+
+# 範囲の広いキーでもnp.argsort(kind='stable')と一致する．
+keys = rand.randint(-2**40, 2**40, 100000)
+print(np.array_equal(key_argsort(keys), np.argsort(keys, kind='stable')))
+# True
+
+# int8やint16の全範囲のキーでも，np.sortと一致することを確かめる．
+for dtype in [np.int8, np.int16, np.uint8, np.uint16]:
+    info = np.iinfo(dtype)
+    keys = rand.randint(info.min, info.max + 1, 100000).astype(dtype)
+    keys[:2] = info.min, info.max
+    assert np.array_equal(key_sort(keys), np.sort(keys))
+    assert np.array_equal(key_argsort(keys), np.argsort(keys, kind='stable'))
+assert np.array_equal(key_sort(np.array([-30000, 30000], dtype=np.int16)), [-30000, 30000])
+
+
+# 1e8行でnp.sort(kind='stable')とnp.lexsortと比較する．
+def benchmark_key_sort(n=10**8):
+    records = np.zeros(n, dtype=[('month', 'i4'), ('day', 'i4'), ('births', 'i4')])
+    records['month'] = rand.randint(1, 13, n)
+    records['day'] = rand.randint(1, 32, n)
+    records['births'] = rand.randint(0, 10**6, n)
+    for name, func in [("np.sort(kind='stable')", lambda: np.sort(records['births'], kind='stable')),
+                       ("key_sort", lambda: key_sort(records['births'])),
+                       ("np.lexsort", lambda: np.lexsort((records['day'], records['month']))),
+                       ("struct_lexsort", lambda: struct_lexsort(records, ['month', 'day']))]:
+        t0 = time.perf_counter()
+        func()
+        print("{0:<24}: {1:.3f} s".format(name, time.perf_counter() - t0))
+
+#benchmark_key_sort()
\ No newline at end of file
@@ -167,4 +167,145 @@ plt.show()
 
 # 残念ながらこれらの作業は手作業で調整する必要がある．
 # なお，ここで使用したスタイルは決してデータを表示するためのベストプラクティスではなく，
-# 単に使用可能なオプションの例を示すためのものです．
\ No newline at end of file
+# 単に使用可能なオプションの例を示すためのものです．
+
+
+
+
+
+# ---------------------------------------------------------
+# ----- 4.11.4 事例：逐次追加データに対するロバスト統計 -----
+# ---------------------------------------------------------
+# 4.11.1では，全期間のbirthsからnp.percentileで四分位数を求め，
+# シグマクリッピング(mu ± 5 * sig の外側を外れ値として除外)を行った．
+# しかし，データが1年分ずつ追加される場合，毎回すべての履歴で四分位数を計算し直すのは無駄．
+# そこで，中央値とIQR(四分位範囲)を逐次的に更新するオブジェクトを作る．
+#   exactモード  : 値とその出現回数をソート済みの配列として保持する(整数カウントなら非常にコンパクト)．
+#                 np.percentileと完全に一致する．
+#   approxモード : 固定個数のビンを持つヒストグラムで近似する(スケッチ)．
+#                 範囲外の値が来たらビン幅を2倍にして隣り合うビンを統合するため，メモリ量は一定．
+#                 誤差は高々ビン幅程度．
+class RobustStats:
+  def __init__(self, mode='exact', n_bins=4096):
+    if mode not in ('exact', 'approx'):
+      raise ValueError("mode must be 'exact' or 'approx'")
+    if n_bins % 2:
+      raise ValueError("n_bins must be even")
+    self.mode = mode
+    self.n = 0
+    # exactモード：ソート済みの値とその個数
+    self.values = np.empty(0)
+    self.counts = np.empty(0, dtype=np.int64)
+    # approxモード：ビンの下端lo，ビン幅width，各ビンの個数
+    self.n_bins = n_bins
+    self.lo = None
+    self.width = None
+    self.hist = np.zeros(n_bins, dtype=np.int64)
+
+  def update(self, batch):
+    # 新しいバッチを取り込む．既存のデータは走査しない．
+    # NaNと±infは取り込まない(approxモードではinfを含む範囲までビンを広げられないため)．
+    batch = np.asarray(batch, dtype=float).ravel()
+    batch = batch[np.isfinite(batch)]
+    if batch.size == 0:
+      return self
+    if self.mode == 'exact':
+      # 新しいバッチを(値, 個数)に圧縮し，既存の表とマージする
+      vals, cnts = np.unique(batch, return_counts=True)
+      allvals = np.concatenate([self.values, vals])
+      allcnts = np.concatenate([self.counts, cnts])
+      self.values, inverse = np.unique(allvals, return_inverse=True)
+      self.counts = np.bincount(inverse, weights=allcnts).astype(np.int64)
+    else:
+      self._expand(batch.min(), batch.max())
+      idx = ((batch - self.lo) // self.width).astype(np.intp)
+      np.clip(idx, 0, self.n_bins - 1, out=idx)
+      self.hist += np.bincount(idx, minlength=self.n_bins)
+    self.n += batch.size
+    return self
+
+  def _expand(self, bmin, bmax):
+    # approxモード：[lo, lo + n_bins * width)が[bmin, bmax]を含むまでビン幅を2倍にする
+    if self.lo is None:
+      self.lo = bmin
+      self.width = (bmax - bmin) / (self.n_bins - 1) if bmax > bmin else 1.0
+      return
+    half = self.n_bins // 2
+    while bmin < self.lo or bmax >= self.lo + self.n_bins * self.width:
+      merged = self.hist.reshape(half, 2).sum(1)
+      self.hist = np.zeros(self.n_bins, dtype=np.int64)
+      if bmin < self.lo:
+        # 下側へ広げる：既存のデータは新しい範囲の上半分に入る
+        self.lo -= self.n_bins * self.width
+        self.hist[half:] = merged
+      else:
+        self.hist[:half] = merged
+      self.width *= 2
+
+  def _order_stat(self, k):
+    # 小さい方からk番目(0始まり)の値
+    if self.mode == 'exact':
+      return self.values[np.searchsorted(np.cumsum(self.counts), k, side='right')]
+    cum = np.cumsum(self.hist)
+    i = np.searchsorted(cum, k, side='right')
+    # ビン内では一様に分布しているとみなして線形補間する
+    before = cum[i] - self.hist[i]
+    return self.lo + self.width * (i + (k - before + 0.5) / self.hist[i])
+
+  def percentile(self, q):
+    # np.percentileと同じ線形補間で百分位数を返す
+    if self.n == 0:
+      raise ValueError("no data")
+    q = np.atleast_1d(q)
+    pos = np.asarray(q, dtype=float) / 100 * (self.n - 1)
+    lower = np.floor(pos)
+    frac = pos - lower
+    a = np.array([self._order_stat(k) for k in lower])
+    b = np.array([self._order_stat(k) for k in np.minimum(lower + 1, self.n - 1)])
+    return a + frac * (b - a)
+
+  @property
+  def median(self):
+    return self.percentile(50)[0]
+
+  @property
+  def iqr(self):
+    q25, q75 = self.percentile([25, 75])
+    return q75 - q25
+
+  @property
+  def sig(self):
+    # 正規分布の標準偏差に対するIQRを用いたロバストな推定値
+    return 0.74 * self.iqr
+
+  def clip_mask(self, batch, k=5, update=True):
+    # バッチを取り込んでから，そのバッチの行だけを評価し，残す行をTrueとするマスクを返す
+    if update:
+      self.update(batch)
+    batch = np.asarray(batch, dtype=float)
+    mu, sig = self.median, self.sig
+    return (batch > mu - k * sig) & (batch < mu + k * sig)
+
+
+# 1年分ずつデータが届くものとして，逐次的に外れ値を除外する．
+births_raw = pd.read_csv('data/births.csv')
+stats = RobustStats(mode='exact')
+sketch = RobustStats(mode='approx')
+kept = []
+for year, batch in births_raw.groupby('year'):
+  sketch.update(batch['births'].values)
+  kept.append(batch[stats.clip_mask(batch['births'].values, k=5)])
+births_clipped = pd.concat(kept)
+
+# 全期間に対するnp.percentileの結果と一致することを確認する．
+quartiles = np.percentile(births_raw['births'], [25, 50, 75])
+print(quartiles)
+print(stats.percentile([25, 50, 75]))
+# [4358.  4814.  5289.5]
+# [4358.  4814.  5289.5]
+
+# approxモードの結果はビン幅程度の誤差を含む．
+print(sketch.percentile([25, 50, 75]), sketch.width)
+
+# 注意：各年のマスクはその年までの統計量で計算されるため，
+# 全期間の統計量でまとめて計算した4.11.1の結果とは，境界付近の数行が異なる場合がある．
\ No newline at end of file
@@ -164,4 +164,168 @@ with plt.style.context('grayscale'):
 import seaborn
 hist_and_lines()
 
-plt.show()
\ No newline at end of file
+plt.show()
+
+
+
+
+
+# ---------------------------------------------------------------------
+# ----- 4.13.4 発展：内容から決まるキーによる描画結果のキャッシュ -----
+# ---------------------------------------------------------------------
+# 4.13.3では，同じhist_and_lines()を7つのスタイルで描画した．
+# データ，コード，スタイルが変わっていなければ，描画結果(PNGやSVGのバイト列)も変わらないので，
+# 毎回描画し直す必要はない．
+# そこで，次の3つからハッシュ値(キー)を計算し，キーをファイル名として描画結果をディスクに保存する．
+#   ・入力の配列(np.memmapはファイル名，サイズ，更新時刻と，ファイル内の位置だけを使うので，大きなファイルでも速い)
+#   ・図を作る関数のソースコード
+#   ・実際に使われるrcParams(plt.style.contextの中ではそのスタイルの設定)
+# キャッシュの合計サイズが上限を超えたら，最も長く使われていないファイルから削除する(LRU)．
+# ただし，関数が参照するグローバル変数や，他の関数の変更はキーに含まれないことに注意．
+import hashlib
+import inspect
+import io
+import mmap
+import os
+import tempfile
+import matplotlib as mpl
+
+class RenderCache:
+  def __init__(self, cache_dir='render_cache', max_bytes=256 * 2**20):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    os.makedirs(cache_dir, exist_ok=True)
+
+  @staticmethod
+  def _memmap_location(v):
+    # memmapのスライスは親のoffsetをそのまま持つので，ファイル内の位置はデータのアドレスから求める．
+    # np.memmapはoffsetをALLOCATIONGRANULARITYの倍数に切り下げた位置からマップしている．
+    base = v
+    while base is not None and not isinstance(base, mmap.mmap):
+      base = getattr(base, 'base', None)
+    if base is None:
+      return None
+    start = np.frombuffer(base, dtype=np.uint8).__array_interface__['data'][0]
+    byte_offset = v.__array_interface__['data'][0] - start + v.offset - v.offset % mmap.ALLOCATIONGRANULARITY
+    return byte_offset, v.strides
+
+  def _hash_value(self, h, v):
+    location = None
+    if isinstance(v, np.memmap) and v.filename is not None:
+      location = self._memmap_location(v)
+    if location is not None:
+      st = os.stat(v.filename)
+      h.update(repr((v.filename, st.st_size, st.st_mtime_ns, location, v.shape, v.dtype.str)).encode())
+    elif isinstance(v, np.ndarray):
+      h.update(repr((v.shape, v.dtype.str)).encode())
+      h.update(np.ascontiguousarray(v).data)
+    elif isinstance(v, (list, tuple)):
+      h.update(repr(type(v)).encode())
+      for item in v:
+        self._hash_value(h, item)
+    elif isinstance(v, dict):
+      for k in sorted(v):
+        h.update(repr(k).encode())
+        self._hash_value(h, v[k])
+    else:
+      h.update(repr(v).encode())
+
+  def key(self, func, args, kwargs, fmt):
+    h = hashlib.sha256()
+    try:
+      h.update(inspect.getsource(func).encode())
+    except (OSError, TypeError):
+      h.update(func.__code__.co_code)
+      h.update(repr(func.__code__.co_consts).encode())
+    self._hash_value(h, list(args))
+    self._hash_value(h, kwargs)
+    h.update(fmt.encode())
+    h.update(repr(sorted((k, repr(v)) for k, v in mpl.rcParams.items())).encode())
+    return h.hexdigest()
+
+  def render(self, func, *args, fmt='png', **kwargs):
+    # func(*args, **kwargs)で描かれる図をfmt形式のバイト列として返す．キャッシュにあれば描画しない．
+    path = os.path.join(self.cache_dir, self.key(func, args, kwargs, fmt) + '.' + fmt)
+    if os.path.exists(path):
+      self.hits += 1
+      os.utime(path)   # 更新時刻を最近使われた順序として使う
+      with open(path, 'rb') as f:
+        return f.read()
+    self.misses += 1
+    fig = func(*args, **kwargs)
+    if not isinstance(fig, mpl.figure.Figure):
+      fig = plt.gcf()
+    buf = io.BytesIO()
+    # 同じ図から同じバイト列が得られるように，バージョンや日付をメタデータに含めない
+    metadata = {'Software': None} if fmt == 'png' else {'Date': None} if fmt in ('svg', 'pdf') else None
+    with mpl.rc_context({'svg.hashsalt': 'render-cache'}):
+      fig.savefig(buf, format=fmt, metadata=metadata)
+    plt.close(fig)
+    data = buf.getvalue()
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(data)
+    os.replace(tmp, path)
+    self._evict(keep=os.path.basename(path))
+    return data
+
+  def savefig(self, fname, func, *args, **kwargs):
+    # fig.savefig(fname)と同じように，拡張子で形式を決めてファイルに書き出す
+    fmt = os.path.splitext(fname)[1][1:].lower() or mpl.rcParams['savefig.format']
+    data = self.render(func, *args, fmt=fmt, **kwargs)
+    with open(fname, 'wb') as f:
+      f.write(data)
+
+  def _evict(self, keep=None):
+    # 上限を超えていれば古いものから削除する(今書き込んだkeepは残す)
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      st = os.stat(os.path.join(self.cache_dir, name))
+      entries.append((st.st_mtime_ns, st.st_size, name))
+    total = sum(e[1] for e in entries)
+    for mtime, size, name in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      if name == keep:
+        continue
+      os.remove(os.path.join(self.cache_dir, name))
+      total -= size
+
+  def stats(self):
+    return dict(hits=self.hits, misses=self.misses,
+                bytes=sum(os.path.getsize(os.path.join(self.cache_dir, n)) for n in os.listdir(self.cache_dir)))
+
+
+# 4.13.3の各スタイルでの描画をキャッシュする．
+# 2回目の実行では，すべてキャッシュから読み込まれる．
+# キャッシュと書き出す画像は，ソースのディレクトリを汚さないように一時ディレクトリに置く．
+cache = RenderCache(os.path.join(tempfile.gettempdir(), 'render_cache'))
+out_dir = os.path.join(tempfile.gettempdir(), 'hist_and_lines')
+os.makedirs(out_dir, exist_ok=True)
+for style in ['default', 'fivethirtyeight', 'ggplot', 'bmh', 'dark_background', 'grayscale']:
+  with plt.style.context(style):
+    cache.savefig(os.path.join(out_dir, 'hist_and_lines_{0}.png'.format(style)), hist_and_lines)
+print(cache.stats())
+# 1回目: {'hits': 0, 'misses': 6, 'bytes': ...}
+# 2回目: {'hits': 6, 'misses': 0, 'bytes': ...}
+
+# 引数の配列もキーに含まれる．データが変わると描画し直す．
+def line_plot(y):
+  fig, ax = plt.subplots()
+  ax.plot(y)
+  return fig
+
+y = np.sin(np.linspace(0, 10, 100))
+svg = cache.render(line_plot, y, fmt='svg')
+svg = cache.render(line_plot, y, fmt='svg')        # ヒット
+svg = cache.render(line_plot, y + 1, fmt='svg')    # ミス
+
+# 同じファイルのmemmapでも，スライスの位置が違えば別のキーになる．
+mm = np.memmap(os.path.join(out_dir, 'series.dat'), dtype='f8', mode='w+', shape=(200,))
+mm[:] = np.sin(np.linspace(0, 10, 200))
+mm.flush()
+print(cache.key(line_plot, (mm[0:100],), {}, 'svg') == cache.key(line_plot, (mm[100:200],), {}, 'svg'))
+# False
+del mm
\ No newline at end of file
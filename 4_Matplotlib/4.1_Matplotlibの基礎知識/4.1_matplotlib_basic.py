@@ -62,4 +62,121 @@ fig.savefig('my_figure.png')
 
 # canvasオブジェクトのメソッドを使用して，
 # システムでサポートされているファイル形式のリストが得られる．
-fig.canvas.get_supported_filetypes()
\ No newline at end of file
+fig.canvas.get_supported_filetypes()
+
+
+
+
+
+# ----------------------------------------------------
+# ----- 4.1.5 発展：ディスプレイなしでの一括描画 -----
+# ----------------------------------------------------
+# 4.1.3.1で見たように，スクリプトではplt.show()で描画結果を表示する．
+# しかし，多数の図をまとめて作り直す場合(例えば，サーバー上で4章のすべての図を生成する場合)は，
+# ディスプレイを使わずに，各図をファイルとして保存したい．
+# そこで，次のようにスクリプトを一括で描画する関数を作る．
+#   ・バックエンドをAgg(ファイル出力専用)に切り替える．
+#   ・plt.show()を置き換え，その時点で開いているすべての図を，スクリプトと同じディレクトリのimages/に保存する．
+#   ・スクリプトや図を作る関数ごとにプロセスプールで並列に実行し，図ごとの描画時間と最大メモリ使用量を報告する．
+#     図ごとのメモリはsavefig中にPythonが確保した量(tracemalloc)．プロセスの最大常駐メモリ(ru_maxrss)は
+#     ワーカープロセスがそれまでに処理したすべてのタスクを通しての最大値なので，図ごとの値ではない．
+#   ・PNGのメタデータからMatplotlibのバージョンを除き，同じ図なら常に同じバイト列になるようにする．
+#     内容が変わらない図はファイルを書き換えないので，変更のあった図だけを検出できる．
+import glob
+import hashlib
+import io
+import os
+import resource
+import runpy
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+def _save_stable(fig, path, fmt='png'):
+  # 図をバイト列として描画し，既存のファイルと異なる場合だけ書き込む．(描画時間, 一時メモリの最大値, 変更の有無)を返す．
+  buf = io.BytesIO()
+  tracemalloc.start()
+  t0 = time.perf_counter()
+  fig.savefig(buf, format=fmt, metadata={'Software': None})
+  seconds = time.perf_counter() - t0
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  data = buf.getvalue()
+  old = None
+  if os.path.exists(path):
+    with open(path, 'rb') as f:
+      old = f.read()
+  changed = old != data
+  if changed:
+    with open(path, 'wb') as f:
+      f.write(data)
+  return seconds, peak, changed, hashlib.sha256(data).hexdigest()[:12]
+
+def _render_task(target):
+  # ワーカープロセスで1つのスクリプト(パス)または図を作る関数(名前, 関数, 出力ディレクトリ)を描画する
+  import matplotlib
+  matplotlib.use('Agg', force=True)
+  import matplotlib.pyplot as plt
+  matplotlib.rcdefaults()
+  plt.close('all')
+  if isinstance(target, str):
+    name = os.path.splitext(os.path.basename(target))[0]
+    out_dir = os.path.join(os.path.dirname(os.path.abspath(target)), 'images')
+  else:
+    name, func, out_dir = target
+  os.makedirs(out_dir, exist_ok=True)
+  report = []
+  def show(*args, **kwargs):
+    # 開いている図をすべて保存して閉じる
+    for num in plt.get_fignums():
+      path = os.path.join(out_dir, '{0}-{1}.png'.format(name, len(report) + 1))
+      seconds, peak, changed, digest = _save_stable(plt.figure(num), path)
+      report.append(dict(target=name, path=path, seconds=seconds, peak_mb=peak / 2**20,
+                         worker_maxrss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+                         changed=changed, sha256=digest, error=None))
+      plt.close(num)
+  plt.show = show
+  cwd = os.getcwd()
+  try:
+    if isinstance(target, str):
+      # スクリプトはdata/などを相対パスで読むので，スクリプトのディレクトリで実行する
+      os.chdir(os.path.dirname(os.path.abspath(target)))
+      runpy.run_path(os.path.basename(target), run_name='__batch__')
+    else:
+      func()
+    show()   # 最後にshow()されなかった図も保存する
+  except Exception as e:
+    report.append(dict(target=name, path=None, seconds=0.0, peak_mb=0.0, worker_maxrss_mb=0.0,
+                       changed=False, sha256=None, error='{0}: {1}'.format(type(e).__name__, e)))
+  finally:
+    os.chdir(cwd)
+  return report
+
+def batch_render(targets, n_workers=None):
+  # targetsには，スクリプトのパスか，(名前, 図を作る関数, 出力ディレクトリ)のタプルを並べる．
+  # 関数はプロセスに渡せるように，モジュールのトップレベルで定義しておく．
+  with ProcessPoolExecutor(n_workers) as pool:
+    reports = [r for rep in pool.map(_render_task, targets) for r in rep]
+  for r in reports:
+    if r['error']:
+      print("{0:<28} ERROR {1}".format(r['target'], r['error']))
+    else:
+      print("{0:<28} {1:>7.3f} s  peak {2:6.1f} MB  worker max rss {3:6.1f} MB  {4}  {5}".format(
+        os.path.basename(r['path']), r['seconds'], r['peak_mb'], r['worker_maxrss_mb'],
+        r['sha256'], 'changed' if r['changed'] else 'unchanged'))
+  return reports
+
+
+# 4.1.4の図を作る関数
+def sin_cos_figure():
+  x = np.linspace(0, 10, 100)
+  fig = plt.figure()
+  plt.plot(x, np.sin(x), '-')
+  plt.plot(x, np.cos(x), '--')
+
+# 関数として渡す場合と，4章のスクリプトをまとめて描画する場合
+#batch_render([('4.1.4', sin_cos_figure, 'images')])
+#batch_render(sorted(glob.glob('../4.*/*.py')), n_workers=4)
+# 4.1.4-1.png                    0.292 s  peak    0.9 MB  worker max rss   63.8 MB  8c46fb6f8ee0  changed
+# ...
+# 2回目以降は，内容が変わらない図はunchangedと表示される．
\ No newline at end of file
@@ -94,4 +94,226 @@ plt.plot(x, np.sin(x), ':b', label='cos(x)')
 plt.axis('equal')
 plt.legend()
 plt.show()
-# plt.legend()メソッドは，線のスタイルと色を記憶し，正しいラベル付けを行う．
\ No newline at end of file
+# plt.legend()メソッドは，線のスタイルと色を記憶し，正しいラベル付けを行う．
+
+
+
+
+
+# -------------------------------------------------------------
+# ----- 4.3.4 発展：長い時系列の間引き(min-max法とLTTB法) -----
+# -------------------------------------------------------------
+# ax.plot(x, np.sin(x))は1000点なら一瞬だが，1e8点の時系列をそのまま渡すと，
+# 描画に時間がかかり，拡大や移動の操作にも反応しなくなる．
+# 画面の横幅は高々数千画素なので，1列の画素に入る多数の点は1本の縦線にしか見えない．
+# そこで，表示範囲の点を画素の列ごとのバケツに分け，点の数を画素数の2倍程度に減らしてから描く．
+#   min-max法: バケツごとに最小値と最大値の2点を残す．各列の縦線の範囲が変わらないので，見た目は元と同じ．
+#   LTTB法   : Largest-Triangle-Three-Buckets．バケツごとに，前に選んだ点と次のバケツの平均とで
+#              作る三角形の面積が最大になる1点を選ぶ．形はよく保たれるが，極値が残る保証はない．
+# xは昇順に並んでいるとする．バケツごとに配列をスライスして調べるので，
+# np.memmapの配列でも，表示範囲の外や全体を一度にメモリに読み込むことはない．
+import io
+import time
+
+def _bucket_edges(x, n_buckets, x_range=None):
+  # 表示範囲[x0, x1]をn_bucketsに等分したときの，各バケツの先頭のインデクス
+  if x_range is None:
+    x_range = (x[0], x[-1])
+  return np.searchsorted(x, np.linspace(x_range[0], x_range[1], n_buckets + 1))
+
+def minmax_decimate(x, y, n_columns, x_range=None):
+  # 各バケツの最小値と最大値(x順)を残したインデクスを返す．最大で2 * n_columns点．
+  edges = _bucket_edges(x, n_columns, x_range)
+  idx = []
+  for start, stop in zip(edges[:-1], edges[1:]):
+    if stop > start:
+      seg = y[start:stop]
+      i, j = start + np.argmin(seg), start + np.argmax(seg)
+      idx += [min(i, j), max(i, j)] if i != j else [i]
+  # 表示範囲の端で線が途切れないように，範囲のすぐ外の点も残す
+  lo, hi = max(edges[0] - 1, 0), min(edges[-1], len(x) - 1)
+  return np.unique(np.concatenate([[lo], np.asarray(idx, dtype=np.intp), [hi]]))
+
+def lttb_decimate(x, y, n_out, x_range=None):
+  # LTTB法で選んだn_out点(両端を含む)のインデクスを返す
+  edges = _bucket_edges(x, n_out - 2, x_range)
+  lo, hi = max(edges[0] - 1, 0), min(edges[-1], len(x) - 1)
+  idx = [lo]
+  a = lo
+  for b in range(n_out - 2):
+    start, stop = edges[b], edges[b + 1]
+    if stop <= start:
+      continue
+    # 次のバケツの平均(最後のバケツでは終点)
+    if b + 2 < len(edges) and edges[b + 2] > stop:
+      cx = np.mean(x[stop:edges[b + 2]])
+      cy = np.mean(y[stop:edges[b + 2]])
+    else:
+      cx, cy = x[hi], y[hi]
+    bx, by = np.asarray(x[start:stop], dtype=float), np.asarray(y[start:stop], dtype=float)
+    area = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+    a = start + np.argmax(area)
+    idx.append(a)
+  idx.append(hi)
+  return np.unique(np.asarray(idx, dtype=np.intp))
+
+class DecimatedLine:
+  # 表示範囲が変わるたびに，Axesの横幅(画素数)に合わせて間引き直す線
+  def __init__(self, ax, x, y, method='minmax', **plot_kwargs):
+    self.ax, self.x, self.y = ax, x, y
+    self.decimate = minmax_decimate if method == 'minmax' else lttb_decimate
+    self.line, = ax.plot([], [], **plot_kwargs)
+    # 全体の範囲(memmapはチャンクごとに読みながら求める)
+    ymin = min(np.min(y[i:i + 2**24]) for i in range(0, len(y), 2**24))
+    ymax = max(np.max(y[i:i + 2**24]) for i in range(0, len(y), 2**24))
+    ax.update_datalim([(x[0], ymin), (x[-1], ymax)])
+    ax.autoscale_view()
+    self.update()
+    ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+
+  def update(self):
+    n = max(2, int(self.ax.bbox.width))
+    n = n if self.decimate is minmax_decimate else 2 * n
+    idx = self.decimate(self.x, self.y, n, self.ax.get_xlim())
+    self.line.set_data(self.x[idx], self.y[idx])
+
+def decimated_plot(x, y, method='minmax', ax=None, **plot_kwargs):
+  if ax is None:
+    ax = plt.gca()
+  return DecimatedLine(ax, x, y, method, **plot_kwargs).line
+
+
+# 1e7点のノイズを含むsin波．1点だけ大きな外れ値を入れておく．
+x = np.linspace(0, 10, 10**7)
+y = np.sin(x) + np.random.RandomState(0).normal(0, 0.1, x.size)
+y[7654321] = 3
+fig, ax = plt.subplots()
+line = decimated_plot(x, y, method='minmax')
+len(line.get_xdata())
+# 1000前後(元の1e7点から減る)
+print(3 in line.get_ydata())
+# True   (min-max法では外れ値も残る．4.11の注釈が指す祝日の谷のような極値も消えない)
+
+# 拡大すると，その範囲で間引き直される
+ax.set_xlim(7.6, 7.7)
+
+# memmapの配列もそのまま渡せる
+# (約80MBのファイルは一時ディレクトリに作り，プログラムの終了時にディレクトリごと削除される)
+import os
+import tempfile
+series_dir = tempfile.TemporaryDirectory()
+np.save(os.path.join(series_dir.name, 'series.npy'), y)
+y_mm = np.load(os.path.join(series_dir.name, 'series.npy'), mmap_mode='r')
+decimated_plot(x, y_mm, method='lttb', ax=plt.figure().gca())
+
+
+# 点の数を変えて，そのまま描く場合と間引いてから描く場合の描画時間を比較する．
+def benchmark_decimation(sizes=(10**6, 10**7, 10**8)):
+  for n in sizes:
+    x = np.linspace(0, 10, n)
+    y = np.sin(x) + np.random.RandomState(0).normal(0, 0.1, n)
+    times = []
+    for draw in [lambda ax: ax.plot(x, y),
+                 lambda ax: decimated_plot(x, y, 'minmax', ax=ax),
+                 lambda ax: decimated_plot(x, y, 'lttb', ax=ax)]:
+      fig, ax = plt.subplots()
+      t0 = time.perf_counter()
+      draw(ax)
+      fig.savefig(io.BytesIO(), format='png')
+      times.append(time.perf_counter() - t0)
+      plt.close(fig)
+    print("n={0:.0e}: plot {1:.2f} s, min-max {2:.2f} s, LTTB {3:.2f} s".format(n, *times))
+
+#benchmark_decimation()
+
+
+
+
+
+# --------------------------------------------------------------
+# ----- 4.3.5 発展：多数の線をまとめて描く(LineCollection) -----
+# --------------------------------------------------------------
+# plt.plot()を1回呼ぶごとに，Line2Dというartist(描画オブジェクト)が1つ作られる．
+# 4.13のfor i in range(3): ax[1].plot(np.random.rand(10))や，
+# 2.8.3のK近傍のネットワークで辺ごとにplt.plot(*zip(X[j], X[i]))を呼ぶ方法は，
+# 線が数本なら問題ないが，1e5本の系列や1e6本の辺になると，artistごとの処理が大半を占める．
+# matplotlib.collections.LineCollectionを使えば，多数の線を1つのartistとして描ける．
+#   ・(線の数, 点の数, 2)の配列をそのまま線分の座標として渡す．
+#   ・線ごとの色や太さは配列で指定する．
+#   ・凡例には，4.8.2と同じように空のリストをプロットしたダミーの線を使う．
+from matplotlib.collections import LineCollection
+
+def plot_lines(Y, x=None, colors=None, linewidths=None, labels=None, ax=None, **kwargs):
+  # Yは(線の数, 点の数)の配列(xを共有する)か，(線の数, 点の数, 2)の座標の配列．
+  # colorsを指定しなければ，plt.plotを繰り返した場合と同じ色の順番(rcParamsの色のサイクル)になる．
+  if ax is None:
+    ax = plt.gca()
+  Y = np.asarray(Y, dtype=float)
+  if Y.ndim == 2:
+    if x is None:
+      x = np.arange(Y.shape[1])
+    segments = np.stack([np.broadcast_to(x, Y.shape), Y], axis=-1)
+  else:
+    segments = Y
+  n = len(segments)
+  if colors is None:
+    cycle = [c['color'] for c in plt.rcParams['axes.prop_cycle']]
+    colors = [cycle[i % len(cycle)] for i in range(n)]
+  if linewidths is None:
+    linewidths = plt.rcParams['lines.linewidth']
+  lc = LineCollection(segments, colors=colors, linewidths=linewidths, **kwargs)
+  ax.add_collection(lc)
+  ax.autoscale_view()
+  if labels is not None:
+    # 凡例用のダミーの線(線ごとの色と太さを使う)
+    widths = np.broadcast_to(linewidths, (n,))
+    for color, width, label in zip(lc.get_colors(), widths, labels):
+      if label is not None:
+        ax.plot([], [], color=color, linewidth=width, label=label)
+  return lc
+
+def plot_knn_edges(X, nearest, ax=None, **kwargs):
+  # 点X[i]から近傍X[nearest[i, k]]への辺を，1つのLineCollectionとして描く．
+  # nearestは(点の数, K)のインデクスの配列(2.8.3のnearest_partition[:, :K+1]など)．
+  N, K = nearest.shape
+  segments = np.stack([np.repeat(X, K, axis=0), X[nearest.ravel()]], axis=1)
+  return plot_lines(segments, colors=kwargs.pop('colors', 'black'), ax=ax, **kwargs)
+
+
+# 4.13のように，ランダムな3本の線を描いて凡例を付ける．
+fig, ax = plt.subplots()
+plot_lines(np.random.rand(3, 10), labels=['a', 'b', 'c'])
+ax.legend(loc='lower left')
+
+# 2.8.3のK近傍のネットワーク．2重のforループの代わりに1回の呼び出しで描く．
+rand = np.random.RandomState(42)
+X = rand.rand(10, 2)
+dist_sq = np.sum((X[:, np.newaxis, :] - X[np.newaxis, :, :]) ** 2, axis=-1)
+K = 2
+nearest_partition = np.argpartition(dist_sq, K + 1, axis=1)
+fig, ax = plt.subplots()
+ax.scatter(X[:, 0], X[:, 1], s=100)
+plot_knn_edges(X, nearest_partition[:, :K + 1])
+
+
+# artistの数と描画時間を，1本ずつplt.plotを呼ぶ場合と比較する．
+def benchmark_line_collection(n_lines=(10**3, 10**4, 10**5), n_points=10):
+  rng = np.random.RandomState(0)
+  for n in n_lines:
+    Y = rng.rand(n, n_points)
+    result = []
+    for name, draw in [('plot', lambda ax: [ax.plot(y) for y in Y]),
+                       ('LineCollection', lambda ax: plot_lines(Y, ax=ax))]:
+      if name == 'plot' and n > 10**4:
+        result.append((float('nan'), 0))   # 1本ずつでは時間がかかりすぎる
+        continue
+      fig, ax = plt.subplots()
+      t0 = time.perf_counter()
+      draw(ax)
+      fig.savefig(io.BytesIO(), format='png')
+      result.append((time.perf_counter() - t0, len(ax.get_children())))
+      plt.close(fig)
+    print("n={0:.0e}: plot {1:.2f} s ({2} artists), LineCollection {3:.2f} s ({4} artists)".format(
+      n, result[0][0], result[0][1], result[1][0], result[1][1]))
+
+#benchmark_line_collection()
\ No newline at end of file
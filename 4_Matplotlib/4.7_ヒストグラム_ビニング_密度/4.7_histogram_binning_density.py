@@ -64,4 +64,528 @@ x, y = np.random.multivariate_normal(mean, cov, 10000).T
 
 # ---------------------------------
 # ----- 4.7.1.3 カーネル密度推定 -----
-# ---------------------------------
\ No newline at end of file
+# ---------------------------------
+
+
+
+
+
+# -----------------------------------------------------------
+# ----- 4.7.2 発展：高速な2次元ビニング(長方形と六角形) -----
+# -----------------------------------------------------------
+# plt.hist2dは内部でnp.histogram2dを，plt.hexbinは六角形の格子への割り当てを使って点を数える．
+# どちらも全データを一度に渡す必要があり，1e9点のようにメモリに収まらないデータの流れ(ストリーム)には使えない．
+# ビンの範囲と数を先に決めておけば，各点のビン番号は算術演算だけで求められる．
+#   長方形: ix = floor((x - xmin) / 幅)のように，x方向とy方向のビン番号を計算して1次元の番号にする．
+#   六角形: plt.hexbinと同じ格子を使う．六角形の中心は，2つの長方形の格子(一方は半分ずらしたもの)に並ぶので，
+#           それぞれの格子で最も近い中心を丸めで求め，近い方(yの距離を√3倍して比べる)を選ぶ．
+# 番号が決まれば，np.bincountで各ビンの点の数を一度に数えられる．
+# データを分けてスレッドごとに部分的な格子で数え，最後に足し合わせる．update(chunk)を繰り返せば，ストリームにも使える．
+import time
+import matplotlib as mpl
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.collections import PolyCollection
+
+def _bin_index(v, edges):
+  # edges[i] <= v < edges[i+1]となるビンの番号i(最後のビンは右端も含む)．範囲外とNaNは-1．
+  # 等間隔なので番号は掛け算で求まるが，丸め誤差で隣のビンにずれることがある．
+  # np.histogramと同じく，境界の配列edgesと比べて1つずらして直す．
+  n = len(edges) - 1
+  lo, hi = edges[0], edges[-1]
+  inside = (v >= lo) & (v <= hi)
+  idx = np.floor(np.where(inside, v - lo, 0) * (n / (hi - lo))).astype(np.intp)
+  np.clip(idx, 0, n - 1, out=idx)
+  idx[v < edges[idx]] -= 1
+  idx[(v >= edges[idx + 1]) & (idx != n - 1)] += 1
+  return np.where(inside, idx, -1)
+
+class Binner2D:
+  def __init__(self, extent, gridsize=100, kind='rect', n_workers=1):
+    if kind not in ('rect', 'hex'):
+      raise ValueError("kind must be 'rect' or 'hex'")
+    xmin, xmax, ymin, ymax = extent
+    self.kind = kind
+    self.n_workers = n_workers
+    if kind == 'rect':
+      self.nx, self.ny = gridsize if np.iterable(gridsize) else (gridsize, gridsize)
+      self.n_cells = self.nx * self.ny
+    else:
+      # plt.hexbin(x, y, gridsize=nx, extent=extent)と同じ格子
+      self.nx, self.ny = gridsize if np.iterable(gridsize) else (gridsize, int(gridsize / np.sqrt(3)))
+      padding = 1e-9 * (xmax - xmin)
+      xmin, xmax = xmin - padding, xmax + padding
+      self.n1 = (self.nx + 1) * (self.ny + 1)   # 1つ目の格子の中心の数
+      self.n_cells = self.n1 + self.nx * self.ny
+    self.extent = (xmin, xmax, ymin, ymax)
+    self.counts = np.zeros(self.n_cells, dtype=np.int64)
+
+  def cell_index(self, x, y):
+    # 各点のビン番号(範囲外は-1)
+    xmin, xmax, ymin, ymax = self.extent
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if self.kind == 'rect':
+      # np.histogram2dと同じく，境界上の値は右側のビンに，右端の値は最後のビンに含める
+      xedges, yedges = self.edges()
+      ix = _bin_index(x, xedges)
+      iy = _bin_index(y, yedges)
+      return np.where((ix >= 0) & (iy >= 0), ix * self.ny + iy, -1)
+    fx = (x - xmin) * (self.nx / (xmax - xmin))
+    fy = (y - ymin) * (self.ny / (ymax - ymin))
+    ny1 = self.ny + 1
+    ix1, iy1 = np.round(fx).astype(np.intp), np.round(fy).astype(np.intp)
+    ix2, iy2 = np.floor(fx).astype(np.intp), np.floor(fy).astype(np.intp)
+    d1 = (fx - ix1) ** 2 + 3.0 * (fy - iy1) ** 2
+    d2 = (fx - ix2 - 0.5) ** 2 + 3.0 * (fy - iy2 - 0.5) ** 2
+    first = d1 < d2
+    in1 = (ix1 >= 0) & (ix1 <= self.nx) & (iy1 >= 0) & (iy1 <= self.ny)
+    in2 = (ix2 >= 0) & (ix2 < self.nx) & (iy2 >= 0) & (iy2 < self.ny)
+    return np.where(first, np.where(in1, ix1 * ny1 + iy1, -1),
+                    np.where(in2, self.n1 + ix2 * self.ny + iy2, -1))
+
+  def _count(self, x, y):
+    idx = self.cell_index(x, y)
+    return np.bincount(idx[idx >= 0], minlength=self.n_cells)
+
+  def update(self, x, y):
+    # チャンクをスレッドごとに分けて数え，部分的な格子を足し合わせる
+    bounds = np.linspace(0, len(x), self.n_workers + 1).astype(np.intp)
+    with ThreadPoolExecutor(self.n_workers) as pool:
+      partials = pool.map(lambda w: self._count(x[bounds[w]:bounds[w + 1]], y[bounds[w]:bounds[w + 1]]),
+                          range(self.n_workers))
+      for partial in partials:
+        self.counts += partial
+    return self
+
+  def edges(self):
+    # 長方形のビンの境界
+    xmin, xmax, ymin, ymax = self.extent
+    return np.linspace(xmin, xmax, self.nx + 1), np.linspace(ymin, ymax, self.ny + 1)
+
+  def centers(self):
+    # 六角形の中心の座標(plt.hexbinのoffsetsと同じ並び)
+    xmin, xmax, ymin, ymax = self.extent
+    sx, sy = (xmax - xmin) / self.nx, (ymax - ymin) / self.ny
+    c1 = np.stack(np.meshgrid(np.arange(self.nx + 1), np.arange(self.ny + 1), indexing='ij'), -1).reshape(-1, 2)
+    c2 = np.stack(np.meshgrid(np.arange(self.nx), np.arange(self.ny), indexing='ij'), -1).reshape(-1, 2) + 0.5
+    return np.concatenate([c1, c2]) * [sx, sy] + [xmin, ymin]
+
+  def draw(self, values=None, ax=None, mincnt=1, **kwargs):
+    # 集計結果を再計算せずに描画する．長方形はpcolormesh，六角形はPolyCollection．
+    # valuesを指定すると，点の数の代わりにその値(ビンごと)で色を付ける．
+    if ax is None:
+      ax = plt.gca()
+    values = self.counts.astype(float) if values is None else np.asarray(values, dtype=float)
+    values = np.where(self.counts >= mincnt, values, np.nan)
+    if self.kind == 'rect':
+      xedges, yedges = self.edges()
+      artist = ax.pcolormesh(xedges, yedges, np.ma.masked_invalid(values.reshape(self.nx, self.ny).T), **kwargs)
+    else:
+      xmin, xmax, ymin, ymax = self.extent
+      sx, sy = (xmax - xmin) / self.nx, (ymax - ymin) / self.ny
+      polygon = [sx, sy / 3] * np.array([[.5, -.5], [.5, .5], [0., 1.], [-.5, .5], [-.5, -.5], [0., -1.]])
+      good = ~np.isnan(values)
+      artist = PolyCollection([polygon], offsets=self.centers()[good],
+                              offset_transform=mpl.transforms.AffineDeltaTransform(ax.transData), **kwargs)
+      artist.set_array(values[good])
+      ax.add_collection(artist)
+      ax.update_datalim([(xmin, ymin), (xmax, ymax)])
+      ax.autoscale_view()
+    plt.sci(artist)
+    return artist
+
+
+# 4.7.1のx，yを，plt.hist2d(x, y, bins=30)と同じ30×30のビンで数える．
+extent = (x.min(), x.max(), y.min(), y.max())
+rect = Binner2D(extent, gridsize=30).update(x, y)
+counts, xedges, yedges = np.histogram2d(x, y, bins=30)
+print(np.array_equal(rect.counts.reshape(30, 30), counts))
+# True
+rect.draw(cmap='Blues')
+plt.colorbar(label='count in bin')
+
+# 六角形のビン．plt.hexbin(x, y, gridsize=30, extent=extent)と同じ値になる．
+hexes = Binner2D(extent, gridsize=30, kind='hex').update(x, y)
+fig, ax = plt.subplots()
+hexes.draw(cmap='Blues')
+plt.colorbar(label='count in bin')
+
+# ストリーム：チャンクを受け取るたびにupdateする
+stream = Binner2D((-5, 5, -7, 7), gridsize=100, kind='hex', n_workers=4)
+for _ in range(10):
+  chunk = np.random.multivariate_normal(mean, cov, 10**5)
+  stream.update(chunk[:, 0], chunk[:, 1])
+stream.counts.sum()
+# 999999   (範囲外の点は数えない)
+
+
+# 1e7点について，np.histogram2dやplt.hexbinと時間を比較する．
+def benchmark_binning(n=10**7, gridsize=200, n_workers=4):
+  xs, ys = np.random.multivariate_normal(mean, cov, n).T
+  extent = (-6, 6, -8, 8)
+  t0 = time.perf_counter()
+  np.histogram2d(xs, ys, bins=gridsize, range=[extent[:2], extent[2:]])
+  t_np = time.perf_counter() - t0
+  t0 = time.perf_counter()
+  Binner2D(extent, gridsize, 'rect', n_workers).update(xs, ys)
+  t_rect = time.perf_counter() - t0
+  fig, ax = plt.subplots()
+  t0 = time.perf_counter()
+  ax.hexbin(xs, ys, gridsize=gridsize, extent=extent)
+  t_mpl = time.perf_counter() - t0
+  t0 = time.perf_counter()
+  Binner2D(extent, gridsize, 'hex', n_workers).update(xs, ys)
+  t_hex = time.perf_counter() - t0
+  plt.close(fig)
+  print("rect: np.histogram2d {0:.2f} s, Binner2D {1:.2f} s".format(t_np, t_rect))
+  print("hex : plt.hexbin {0:.2f} s, Binner2D {1:.2f} s".format(t_mpl, t_hex))
+
+#benchmark_binning()
+
+
+
+
+
+# -------------------------------------------------------------------
+# ----- 4.7.3 発展：C引数付きhexbinのセルごとの集約のベクトル化 -----
+# -------------------------------------------------------------------
+# plt.hexbin(x, y, C=値, reduce_C_function=np.mean)とすると，各六角形に入った点の値Cを集約して色を付けられる．
+# しかしMatplotlibは，値を六角形ごとのPythonのリストに1つずつ追加してから，六角形ごとにreduce_C_functionを呼ぶ．
+# 1e7点では，このループに数分かかる．
+# 4.7.2のBinner2Dでセルの番号を求めてから，NumPyの関数でセルごとにまとめて集約する．
+#   count，sum，mean : np.bincount(weights=C)で，セルごとの個数と合計を一度に求める．
+#   max，min，std    : セルの番号で並べ替え，同じセルの区間ごとにufunc.reduceatで集約する．
+#   median           : (セル, 値)の順に並べ替え，各区間の中央の要素を取り出す．
+_cell_reducers = {np.mean: 'mean', np.sum: 'sum', np.max: 'max', np.min: 'min',
+                  np.std: 'std', np.median: 'median', len: 'count'}
+
+def reduce_cells(cell, C, n_cells, reduce='mean'):
+  # セル番号cell(範囲外は-1)ごとにCを集約した長さn_cellsの配列を返す(点のないセルはNaN)
+  reduce = _cell_reducers.get(reduce, reduce)
+  inside = cell >= 0
+  cell = cell[inside]
+  C = np.asarray(C, dtype=float)[inside]
+  count = np.bincount(cell, minlength=n_cells)
+  out = np.full(n_cells, np.nan)
+  if reduce == 'count':
+    return count.astype(float)
+  if reduce in ('sum', 'mean'):
+    total = np.bincount(cell, weights=C, minlength=n_cells)
+    if reduce == 'sum':
+      return np.where(count > 0, total, np.nan)
+    np.divide(total, count, out=out, where=count > 0)
+    return out
+  order = np.lexsort((C, cell)) if reduce == 'median' else np.argsort(cell, kind='stable')
+  v = C[order]
+  sorted_cell = cell[order]
+  starts = np.flatnonzero(np.r_[True, sorted_cell[1:] != sorted_cell[:-1]]) if len(v) else np.empty(0, np.intp)
+  targets = sorted_cell[starts]
+  lens = count[targets]
+  if reduce == 'max':
+    out[targets] = np.maximum.reduceat(v, starts)
+  elif reduce == 'min':
+    out[targets] = np.minimum.reduceat(v, starts)
+  elif reduce == 'std':
+    m = np.add.reduceat(v, starts) / lens
+    dev = v - np.repeat(m, lens)
+    out[targets] = np.sqrt(np.add.reduceat(dev * dev, starts) / lens)
+  elif reduce == 'median':
+    out[targets] = (v[starts + (lens - 1) // 2] + v[starts + lens // 2]) / 2
+  else:
+    # その他の関数は，区間ごとに呼び出す(Pythonのリストは作らない)
+    out[targets] = [reduce(seg) for seg in np.split(v, starts[1:])]
+  return out
+
+def hexbin_reduce(x, y, C, reduce='mean', gridsize=100, extent=None, mincnt=1, ax=None, **kwargs):
+  # plt.hexbin(x, y, C=C, reduce_C_function=reduce, gridsize=gridsize, extent=extent)と同じ図を描く
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  if extent is None:
+    # plt.hexbinと同じく，すべて同じ値の場合は範囲を10%広げる
+    extent = []
+    for v in (x, y):
+      lo, hi = v.min(), v.max()
+      d = 0 if hi > lo else 0.1 * abs(lo) if lo else 0.1
+      extent += [lo - d, hi + d]
+  binner = Binner2D(extent, gridsize, kind='hex')
+  cell = binner.cell_index(x, y)
+  binner.counts = np.bincount(cell[cell >= 0], minlength=binner.n_cells)
+  return binner.draw(reduce_cells(cell, C, binner.n_cells, reduce), ax=ax, mincnt=mincnt, **kwargs)
+
+
+# 4.7.1のデータで，各六角形に入った点のx * yの平均で色を付ける．
+fig, ax = plt.subplots()
+hb = hexbin_reduce(x, y, x * y, np.mean, gridsize=30, cmap='RdBu_r')
+plt.colorbar(label='mean of x * y')
+
+# plt.hexbinと同じ値になる．
+fig, ax = plt.subplots()
+ref = ax.hexbin(x, y, C=x * y, reduce_C_function=np.mean, gridsize=30)
+print(np.allclose(ref.get_array(), hb.get_array()))
+# True
+
+# 中央値や標準偏差も同様に計算できる．
+hexbin_reduce(x, y, x * y, 'median', gridsize=30, ax=plt.figure().gca())
+
+
+# 1e7点，約1e5個の六角形(gridsize=300)で，plt.hexbinと時間を比較する．
+def benchmark_hexbin_reduce(n=10**7, gridsize=300):
+  xs, ys = np.random.multivariate_normal(mean, cov, n).T
+  C = xs * ys
+  for func in [np.mean, np.median, np.std]:
+    fig, ax = plt.subplots()
+    t0 = time.perf_counter()
+    ref = ax.hexbin(xs, ys, C=C, reduce_C_function=func, gridsize=gridsize)
+    t_mpl = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    hb = hexbin_reduce(xs, ys, C, func, gridsize=gridsize, ax=ax)
+    t_vec = time.perf_counter() - t0
+    plt.close(fig)
+    print("{0:<6}: plt.hexbin {1:.1f} s, hexbin_reduce {2:.2f} s, same={3}".format(
+      func.__name__, t_mpl, t_vec, np.allclose(ref.get_array(), hb.get_array())))
+
+#benchmark_hexbin_reduce()
+
+
+
+
+
+# ---------------------------------------------------------
+# ----- 4.7.4 発展：FFTを使ったビン化カーネル密度推定 -----
+# ---------------------------------------------------------
+# カーネル密度推定(KDE)は，各サンプルの位置にカーネル(ここではガウス分布)を置いて足し合わせたもの．
+# 4.16のsns.kdeplotやsns.jointplot(kind='kde')は，格子の各点ですべてのサンプルとの距離を計算するので，
+# サンプル数n，格子点数Gに対してO(nG)の計算が必要になる．
+# 格子の間隔がバンド幅より十分小さければ，次の2段階で同じ結果を近似的に求められる．
+#   1. 線形ビニング：各サンプルの重みを，両隣(2次元では周囲4つ)の格子点に距離に応じて配分する(np.bincount)．
+#   2. 格子上の重みとカーネルの値の畳み込みをFFTで計算する．
+# 計算量はO(n + G log G)になる．
+# バンド幅はScottの方法かSilvermanの方法で決め，データの共分散行列にかける(相関のある2次元データにも使える)．
+def kde_bandwidth(data, method='scott', weights=None):
+  # カーネルの共分散行列(d×d)を返す
+  data = np.atleast_2d(np.asarray(data, dtype=float).T).T
+  n, d = data.shape
+  w = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+  n_eff = w.sum() ** 2 / (w * w).sum()
+  if method == 'scott':
+    factor = n_eff ** (-1 / (d + 4))
+  elif method == 'silverman':
+    factor = (n_eff * (d + 2) / 4) ** (-1 / (d + 4))
+  else:
+    factor = float(method)   # 数値を渡した場合はそのまま係数とする
+  return np.atleast_2d(np.cov(data.T, aweights=w)) * factor ** 2
+
+def fft_kde(data, weights=None, bw='scott', gridsize=512, cut=3, extent=None):
+  # dataは(n,)または(n, 2)の配列．
+  # 1次元なら(格子, 密度)を，2次元なら(xの格子, yの格子, 密度[yの番号, xの番号])を返す．
+  # 戻り値はそのままplt.fill_betweenやplt.contourfに渡せる．
+  data = np.asarray(data, dtype=float)
+  one_dim = data.ndim == 1
+  data = data.reshape(len(data), -1)
+  n, d = data.shape
+  w = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+  w = w / w.sum()
+  K = kde_bandwidth(data, bw, w)
+  sd = np.sqrt(np.diag(K))
+  G = np.broadcast_to(gridsize, (d,))
+  if extent is None:
+    extent = np.ravel([(data[:, k].min() - cut * sd[k], data[:, k].max() + cut * sd[k]) for k in range(d)])
+  lo = np.asarray(extent[0::2], dtype=float)
+  hi = np.asarray(extent[1::2], dtype=float)
+  delta = (hi - lo) / (G - 1)
+  grids = [np.linspace(lo[k], hi[k], G[k]) for k in range(d)]
+
+  # 1. 線形ビニング
+  # extentの外の点は格子の端に寄せずに除く(重みの正規化は全体の点で行ったまま)
+  inside = np.all((data >= lo) & (data <= hi), axis=1)
+  pos = (data[inside] - lo) / delta
+  w_in = w[inside]
+  base = np.clip(np.floor(pos).astype(np.intp), 0, G - 2)
+  frac = np.clip(pos - base, 0, 1)
+  counts = np.zeros(int(np.prod(G)))
+  for corner in np.ndindex(*(2,) * d):
+    corner = np.array(corner)
+    idx = np.ravel_multi_index((base + corner).T, G)
+    share = w_in * np.prod(np.where(corner, frac, 1 - frac), axis=1)
+    counts += np.bincount(idx, weights=share, minlength=counts.size)
+  counts = counts.reshape(G)
+
+  # 2. カーネルを格子の間隔で評価し(±4標準偏差まで)，FFTで畳み込む
+  L = np.minimum(G - 1, np.ceil(4 * sd / delta).astype(int))
+  offsets = np.meshgrid(*[np.arange(-L[k], L[k] + 1) * delta[k] for k in range(d)], indexing='ij')
+  u = np.stack(offsets, axis=-1)
+  Kinv = np.linalg.inv(K)
+  kernel = np.exp(-0.5 * np.einsum('...i,ij,...j->...', u, Kinv, u))
+  kernel /= np.sqrt((2 * np.pi) ** d * np.linalg.det(K))
+  shape = [G[k] + 2 * L[k] for k in range(d)]
+  axes = list(range(d))
+  density = np.fft.irfftn(np.fft.rfftn(counts, shape, axes) * np.fft.rfftn(kernel, shape, axes), shape, axes)
+  density = density[tuple(slice(L[k], L[k] + G[k]) for k in range(d))]
+  np.maximum(density, 0, out=density)   # FFTの丸め誤差による小さな負の値を除く
+  if one_dim:
+    return grids[0], density
+  return grids[0], grids[1], density.T
+
+
+# 4.16.2.1と同じデータで，各列の1次元の密度(sns.kdeplot(data[col], shade=True))を描く．
+data = np.random.multivariate_normal([0, 0], [[5, 2], [2, 2]], size=2000)
+fig, ax = plt.subplots()
+for k in range(2):
+  grid, dens = fft_kde(data[:, k])
+  ax.fill_between(grid, dens, alpha=0.5)
+
+# 格子の各点で直接計算したKDEとの差は，最大値の0.01%程度．
+grid, dens = fft_kde(data[:, 0])
+h = np.sqrt(kde_bandwidth(data[:, 0])[0, 0])
+direct = np.exp(-0.5 * ((grid[:, np.newaxis] - data[np.newaxis, :, 0]) / h) ** 2).sum(1) / (len(data) * h * np.sqrt(2 * np.pi))
+print(np.abs(dens - direct).max() / direct.max())
+# 7.6e-05
+
+# 2次元の密度(sns.kdeplot(data)やsns.jointplot(kind='kde')に相当)．128×128の格子で，直接計算との差は最大値の0.3%程度．
+gx, gy, Z = fft_kde(data, gridsize=128)
+fig, ax = plt.subplots()
+ax.contourf(gx, gy, Z, levels=10, cmap='Blues')
+
+# 重み付きのサンプル，Silvermanの方法
+fft_kde(data[:, 0], weights=np.abs(data[:, 1]), bw='silverman')
+
+
+# サンプル数を変えて，直接計算(O(nG))とFFTを使う方法の時間を比較する．
+def benchmark_kde(sizes=(10**4, 10**5, 10**6, 10**7, 10**8), gridsize=512):
+  rng = np.random.RandomState(0)
+  for n in sizes:
+    xs = rng.standard_normal(n)
+    t0 = time.perf_counter()
+    grid, dens = fft_kde(xs, gridsize=gridsize)
+    t_fft = time.perf_counter() - t0
+    if n <= 10**6:
+      h = np.sqrt(kde_bandwidth(xs)[0, 0])
+      t0 = time.perf_counter()
+      direct = sum(np.exp(-0.5 * ((grid[:, np.newaxis] - xs[np.newaxis, i:i + 10**4]) / h) ** 2).sum(1)
+                   for i in range(0, n, 10**4)) / (n * h * np.sqrt(2 * np.pi))
+      t_direct = time.perf_counter() - t0
+      err = np.abs(dens - direct).max() / direct.max()
+      print("n={0:.0e}: direct {1:.2f} s, FFT {2:.3f} s, rel. error {3:.1e}".format(n, t_direct, t_fft, err))
+    else:
+      print("n={0:.0e}: FFT {1:.3f} s".format(n, t_fft))
+
+#benchmark_kde()
+
+
+
+
+
+# ------------------------------------------------------------------
+# ----- 4.7.5 発展：ビンの境界を共有する複数系列のヒストグラム -----
+# ------------------------------------------------------------------
+# 4.7ではplt.hist(x1, **kwargs)，plt.hist(x2, **kwargs)，plt.hist(x3, **kwargs)と3回呼び出して重ねて描いた．
+# 各呼び出しは，自分のデータの最小値と最大値からビンの境界を決め，データを別々に走査する．
+# そのため，ビンの境界が系列ごとに異なり，数十の系列を重ねると境界を決めるだけで系列の数だけ走査が必要になる．
+# そこで，
+#   ・すべての系列の最小値と最大値から，共通のビンの境界を決める．
+#   ・(系列の番号 * ビンの数 + ビンの番号)を1回のnp.bincountで数え，(系列, ビン)の行列を作る．
+#   ・各系列の階段状の輪郭を多角形として，1つのPolyCollectionで描く．
+import io
+
+def multi_histogram(series, bins=40, range=None, density=False):
+  # seriesは1次元配列のリスト(長さが異なってもよい)か，各列を1つの系列とする2次元配列．
+  # (系列の数, bins)の個数(density=Trueなら密度)の行列と，ビンの境界を返す．
+  # NaNは数えない．範囲とdensityの扱いはnp.histogramと同じ．
+  if isinstance(series, np.ndarray) and series.ndim == 2:
+    n_series = series.shape[1]
+    values = series.ravel()
+    which = np.tile(np.arange(n_series), series.shape[0])
+  else:
+    series = [np.asarray(s, dtype=float).ravel() for s in series]
+    n_series = len(series)
+    values = np.concatenate(series) if series else np.empty(0)
+    which = np.repeat(np.arange(n_series), [len(s) for s in series])
+  valid = ~np.isnan(values)
+  values, which = values[valid], which[valid]
+  if range is None:
+    range = (values.min(), values.max()) if values.size else (0, 1)
+  lo, hi = float(range[0]), float(range[1])
+  if not (np.isfinite(lo) and np.isfinite(hi)):
+    raise ValueError("range [{0}, {1}] is not finite".format(lo, hi))
+  if lo > hi:
+    raise ValueError("max must be larger than min in range parameter")
+  if lo == hi:
+    lo, hi = lo - 0.5, hi + 0.5   # np.histogramと同じく，幅0の範囲は広げる
+  edges = np.linspace(lo, hi, bins + 1)
+  # 4.7.2と同じく，境界上の値の扱いもnp.histogramに合わせる
+  idx = _bin_index(values, edges)
+  inside = idx >= 0
+  counts = np.bincount(which[inside] * bins + idx[inside], minlength=n_series * bins)
+  counts = counts.reshape(n_series, bins)
+  if density:
+    # 範囲外の値を除いた個数で正規化する
+    with np.errstate(invalid='ignore', divide='ignore'):
+      return counts / (counts.sum(axis=1, keepdims=True) * np.diff(edges)), edges
+  return counts, edges
+
+def multi_hist(series, bins=40, range=None, density=False, labels=None, alpha=0.3, ax=None, **kwargs):
+  # histtype='stepfilled'のplt.histを系列の数だけ呼ぶ代わりに，1つのPolyCollectionで描く
+  if ax is None:
+    ax = plt.gca()
+  counts, edges = multi_histogram(series, bins, range, density)
+  n = len(counts)
+  # 輪郭の頂点：(edges[0], 0), (edges[0], c0), (edges[1], c0), (edges[1], c1), ..., (edges[-1], 0)
+  verts = np.empty((n, 2 * bins + 2, 2))
+  verts[:, :, 0] = np.repeat(edges, 2)
+  verts[:, 0, 1] = verts[:, -1, 1] = 0
+  verts[:, 1:-1, 1] = np.repeat(counts, 2, axis=1)
+  cycle = [c['color'] for c in plt.rcParams['axes.prop_cycle']]
+  colors = [cycle[i % len(cycle)] for i in np.arange(n)]
+  pc = PolyCollection(verts, facecolors=colors, edgecolors='none', alpha=alpha, **kwargs)
+  ax.add_collection(pc)
+  ax.autoscale_view()
+  if labels is not None:
+    # 4.8.2と同じく，凡例には空のリストを描いたダミーを使う
+    for color, label in zip(colors, labels):
+      ax.fill([], [], color=color, alpha=alpha, label=label)
+  return counts, edges, pc
+
+
+# 4.7のx1，x2，x3を，共通のビンで1回で描く．
+fig, ax = plt.subplots()
+counts, edges, pc = multi_hist([x1, x2, x3], bins=40, density=True, labels=['x1', 'x2', 'x3'])
+ax.legend()
+
+# 各系列をnp.histogramで同じ境界を使って数えた結果と一致する．
+print(all(np.allclose(counts[i], np.histogram(s, edges, density=True)[0]) for i, s in enumerate([x1, x2, x3])))
+# True
+
+# ビンの境界ちょうどの値(0.1刻みのデータなど)も，np.histogramと同じビンに入る．
+grid_data = np.round(np.random.rand(10000), 1)
+print(np.array_equal(multi_histogram([grid_data], bins=10, range=(0, 1))[0][0],
+                     np.histogram(grid_data, bins=10, range=(0, 1))[0]))
+# True
+
+# 4.16.2.1のように，2次元配列の各列を系列として渡すこともできる．
+block = np.random.multivariate_normal([0, 0], [[5, 2], [2, 2]], size=2000)
+fig, ax = plt.subplots()
+multi_hist(block, bins=30, density=True, alpha=0.5, labels=['x', 'y'])
+ax.legend()
+
+
+# 系列の数を変えて，plt.histを繰り返し呼ぶ場合と描画時間を比較する．
+def benchmark_multi_hist(n_series=(3, 30, 100), n=10**6, bins=40):
+  rng = np.random.RandomState(0)
+  for m in n_series:
+    block = rng.standard_normal((n, m)) + np.arange(m)
+    fig, ax = plt.subplots()
+    t0 = time.perf_counter()
+    for k in np.arange(m):
+      ax.hist(block[:, k], bins=bins, histtype='stepfilled', alpha=0.3, density=True)
+    fig.savefig(io.BytesIO(), format='png')
+    t_hist = time.perf_counter() - t0
+    plt.close(fig)
+    fig, ax = plt.subplots()
+    t0 = time.perf_counter()
+    multi_hist(block, bins=bins, density=True)
+    fig.savefig(io.BytesIO(), format='png')
+    t_multi = time.perf_counter() - t0
+    plt.close(fig)
+    print("{0:>3} series: plt.hist x{0} {1:.2f} s, multi_hist {2:.2f} s".format(m, t_hist, t_multi))
+
+#benchmark_multi_hist()
\ No newline at end of file
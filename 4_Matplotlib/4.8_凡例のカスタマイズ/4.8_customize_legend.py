@@ -120,4 +120,145 @@ from matplotlib.legend import Legend
 leg = Legend(ax, lines[:2], ['line C', 'line D'], loc='lower right', frameon=False)
 ax.add_artist(leg)
 
-plt.show()
\ No newline at end of file
+plt.show()
+
+
+
+
+
+# ----------------------------------------------------------
+# ----- 4.8.4 発展：大量の点を画素に集約して描く散布図 -----
+# ----------------------------------------------------------
+# 4.8.2のplt.scatterは，点ごとにマーカーのパスを作って描画する．
+# 数百の都市なら問題ないが，1e7点になると描画に数分かかり，保存したファイルも巨大になる．
+# 点の数がしきい値を超えたら，Axesの画素ごとに点を集約した1枚の画像としてimshowで描く．
+#   ・各点の画素の位置(行，列)を1次元のインデクスに直し，np.bincountで画素ごとに集計する．
+#   ・色の値cは画素ごとに平均('mean')，最大('max')，または点の数('count')にまとめる．
+#   ・拡大や移動で表示範囲が変わったら，次に描画するときに1回だけ，その範囲の画素で集約し直す．
+import io
+import time
+
+class RasterScatter:
+  def __init__(self, ax, x, y, c=None, reduce='mean', **imshow_kwargs):
+    if reduce not in ('mean', 'max', 'count'):
+      raise ValueError("reduce must be 'mean', 'max' or 'count'")
+    if c is None:
+      reduce = 'count'
+    self.ax = ax
+    self.x = np.asarray(x, dtype=float)
+    self.y = np.asarray(y, dtype=float)
+    self.c = None if c is None else np.asarray(c, dtype=float)
+    self.reduce = reduce
+    # データの範囲を表示範囲にする
+    ax.update_datalim(np.array([[self.x.min(), self.y.min()], [self.x.max(), self.y.max()]]))
+    ax.autoscale_view()
+    self.image = ax.imshow(self.aggregate(), extent=self.extent(), origin='lower',
+                           interpolation='nearest', aspect=ax.get_aspect(), **imshow_kwargs)
+    ax.set_xlim(self.extent()[:2])
+    ax.set_ylim(self.extent()[2:])
+    # xlimとylimは1回の拡大・移動で両方変わるので，コールバックでは印を付けるだけにして，
+    # 描画の直前に1回だけ集約し直す．
+    # 束縛メソッドはコールバックに弱参照で登録されるので，関数で包んでオブジェクトを保持させる
+    self.stale = False
+    ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+    ax.callbacks.connect('ylim_changed', lambda ax: self.update())
+    ax.figure.canvas.mpl_connect('resize_event', lambda event: self.update())
+    draw = self.image.draw
+    def lazy_draw(renderer):
+      if self.stale:
+        self.refresh()
+      draw(renderer)
+    self.image.draw = lazy_draw
+
+  def extent(self):
+    x0, x1 = self.ax.get_xlim()
+    y0, y1 = self.ax.get_ylim()
+    return [x0, x1, y0, y1]
+
+  def aggregate(self):
+    # 現在の表示範囲とAxesの画素数で集約した画像(点のない画素はNaN)
+    x0, x1, y0, y1 = self.extent()
+    W = max(1, int(round(self.ax.bbox.width)))
+    H = max(1, int(round(self.ax.bbox.height)))
+    ix = np.floor((self.x - x0) * (W / (x1 - x0))).astype(np.intp)
+    iy = np.floor((self.y - y0) * (H / (y1 - y0))).astype(np.intp)
+    inside = (ix >= 0) & (ix < W) & (iy >= 0) & (iy < H)
+    pixel = iy[inside] * W + ix[inside]
+    count = np.bincount(pixel, minlength=W * H).astype(float)
+    if self.reduce == 'count':
+      img = count
+    elif self.reduce == 'mean':
+      with np.errstate(invalid='ignore'):
+        img = np.bincount(pixel, weights=self.c[inside], minlength=W * H) / count
+    else:
+      # np.maximum.atは遅いので，画素の番号でソートして画素ごとの区間をnp.maximum.reduceatで集約する
+      img = np.full(W * H, -np.inf)
+      order = np.argsort(pixel, kind='stable')
+      pixel = pixel[order]
+      if pixel.size:
+        starts = np.flatnonzero(np.r_[True, pixel[1:] != pixel[:-1]])
+        img[pixel[starts]] = np.maximum.reduceat(self.c[inside][order], starts)
+    img[count == 0] = np.nan
+    return img.reshape(H, W)
+
+  def update(self):
+    # 表示範囲や大きさが変わった．集約し直すのは次の描画のとき．
+    self.stale = True
+    self.image.stale = True
+
+  def refresh(self):
+    self.stale = False
+    self.image.set_data(self.aggregate())
+    self.image.set_extent(self.extent())
+
+def raster_scatter(x, y, c=None, reduce='mean', threshold=10**5, ax=None, **kwargs):
+  # 点の数がthreshold以下ならplt.scatterと同じ．超えたら画素に集約したAxesImageを返す．
+  # 戻り値はplt.colorbar()やplt.clim()の対象になる．
+  if ax is None:
+    ax = plt.gca()
+  if len(x) <= threshold:
+    return ax.scatter(x, y, c=c, **kwargs)
+  imshow_kwargs = {k: v for k, v in kwargs.items() if k in ('cmap', 'norm', 'vmin', 'vmax', 'alpha')}
+  image = RasterScatter(ax, x, y, c, reduce, **imshow_kwargs).image
+  plt.sci(image)
+  return image
+
+
+# 4.8.2の都市の周辺に1e6人分の点をばらまき，都市の人口(log10)で色を付ける．
+rng = np.random.default_rng(0)
+idx = rng.integers(0, len(cities), 10**6)
+px = lon.values[idx] + rng.normal(0, 0.1, idx.size)
+py = lat.values[idx] + rng.normal(0, 0.1, idx.size)
+pc = np.log10(population.values[idx])
+
+fig, ax = plt.subplots()
+raster_scatter(px, py, c=pc, reduce='max', cmap='viridis')
+plt.xlabel('longitude')
+plt.ylabel('latitude')
+plt.colorbar(label='log$_{10}$(population)')
+plt.clim(3, 7)
+# 拡大すると，その範囲で集約し直される(サンフランシスコ周辺)
+ax.set_xlim(-123, -121.5)
+ax.set_ylim(37, 38.5)
+
+
+# 点の数を変えて，plt.scatterと保存(描画)にかかる時間とファイルサイズを比較する．
+def benchmark_raster_scatter(sizes=(10**5, 10**6, 10**7)):
+  rng = np.random.default_rng(0)
+  for n in sizes:
+    x, y = rng.standard_normal((2, n))
+    c = x * y
+    result = []
+    for name, draw in [('scatter', lambda ax: ax.scatter(x, y, c=c, s=1)),
+                       ('raster_scatter', lambda ax: raster_scatter(x, y, c=c, threshold=0, ax=ax))]:
+      fig, ax = plt.subplots()
+      buf = io.BytesIO()
+      t0 = time.perf_counter()
+      draw(ax)
+      fig.savefig(buf, format='png')
+      result.append((time.perf_counter() - t0, buf.tell()))
+      plt.close(fig)
+    print("n={0:.0e}: scatter {1:.2f} s ({2:,} bytes), raster_scatter {3:.2f} s ({4:,} bytes)".format(
+      n, result[0][0], result[0][1], result[1][0], result[1][1]))
+
+#benchmark_raster_scatter()
\ No newline at end of file
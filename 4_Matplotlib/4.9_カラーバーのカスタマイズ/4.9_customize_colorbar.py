@@ -133,4 +133,139 @@ plt.show()
 
 # ---------------------------------
 # ----- 4.9.2 事例：手書きの数字 -----
-# ---------------------------------
\ No newline at end of file
+# ---------------------------------
+
+
+
+
+
+# ----------------------------------------------------------------------
+# ----- 4.9.3 発展：uint8のカラーマップ表(LUT)を使った高速な色付け -----
+# ----------------------------------------------------------------------
+# plt.imshow(I, cmap=...)は，描画のたびに値を正規化して[0, 1]の浮動小数点数にし，
+# カラーマップでRGBAの浮動小数点数に変換してから，画像用の8ビットの値に変換する．
+# grayscale_cmapやview_colormapでも，呼び出しのたびにcmap(np.arange(cmap.N))を計算している．
+# 8k×8kのような大きな画像を毎フレーム描く場合，この変換が処理時間の大半を占める．
+# そこで，
+#   ・カラーマップごとに，uint8のRGBAの表(LUT)を一度だけ作ってキャッシュする．
+#     名前で指定した場合は名前を，Colormapのオブジェクトを渡した場合はオブジェクトそのもの(id)をキーにする．
+#     名前が同じでも色の違うカラーマップ(ListedColormapなど)があるので，オブジェクトは名前では区別しない．
+#     オブジェクトが解放されたら，その表もキャッシュから削除する(weakref.finalize)．
+#     表の最後には，Matplotlibと同じく範囲外(下，上)と無効値(NaN)の色を置く(set_under，set_over，set_badの色)．
+#     grayscale_cmapと同じ輝度に変換したグレースケール版(_gray)も，同じようにキャッシュする．
+#   ・値を行のブロックごとに整数の番号に変換し，np.takeで表を引いてRGBAにする．ブロックはスレッドで並列に処理する．
+# extend(4.9.1.2)はカラーバーの形を変えるだけで，範囲外の値の色はカラーマップのunder/overの色で決まる．
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import matplotlib as mpl
+
+_LUT_CACHE = {}
+
+def colormap_lut(cmap, gray=False):
+  # (cmap.N + 3, 4)のuint8の表．最後の3行は下側，上側，無効値の色．
+  # 登録済みのカラーマップは名前で引く(plt.get_cmapは呼び出しのたびにコピーを返すため)
+  if isinstance(cmap, str):
+    key, extremes = (cmap, gray), None
+  else:
+    # set_badなどで色を変えることもできるので，範囲外と無効値の色も一致を確かめる
+    key = (id(cmap), gray)
+    extremes = (cmap.N, tuple(cmap.get_under()), tuple(cmap.get_over()), tuple(cmap.get_bad()))
+  entry = _LUT_CACHE.get(key)
+  if entry is not None and entry[0] == extremes:
+    return entry[1]
+  obj = plt.get_cmap(cmap)
+  colors = np.vstack([obj(np.arange(obj.N)), obj.get_under(), obj.get_over(), obj.get_bad()])
+  if gray:
+    RGB_weight = [0.299, 0.587, 0.114]
+    colors[:, :3] = np.sqrt(np.dot(colors[:, :3] ** 2, RGB_weight))[:, np.newaxis]
+  # cmap(..., bytes=True)と同じ変換
+  lut = (colors * 255).astype(np.uint8)
+  if entry is None and extremes is not None:
+    # idは解放後に再利用されるので，オブジェクトが解放されたら表も削除する
+    weakref.finalize(cmap, _LUT_CACHE.pop, key, None)
+  _LUT_CACHE[key] = (extremes, lut)
+  return lut
+
+def colorize(data, cmap='viridis', vmin=None, vmax=None, gray=False, out=None, n_workers=4, block_rows=256):
+  # plt.imshow(data, cmap=cmap, vmin=vmin, vmax=vmax)と同じ色の(行, 列, 4)のuint8の配列を返す．
+  # 結果はplt.imshowにそのまま渡せる．np.maのマスクされた値は，NaNと同じく無効値の色になる．
+  lut = colormap_lut(cmap, gray)
+  N = len(lut) - 3
+  masked = np.ma.isMaskedArray(data)
+  if vmin is None:
+    vmin = np.ma.masked_invalid(data).min() if masked else np.nanmin(data)
+  if vmax is None:
+    vmax = np.ma.masked_invalid(data).max() if masked else np.nanmax(data)
+  if out is None:
+    out = np.empty(data.shape + (4,), dtype=np.uint8)
+  def work(r0):
+    # plt.Normalizeとカラーマップの計算と同じ順序で，値を番号に変換する
+    block = data[r0:r0 + block_rows]
+    x = np.array(np.ma.getdata(block), dtype=np.result_type(data.dtype, np.float32))
+    x -= vmin
+    if vmax > vmin:
+      x /= vmax - vmin
+    else:
+      x[...] = 0
+    x *= N
+    x[x == N] = N - 1
+    with np.errstate(invalid='ignore'):
+      codes = x.astype(np.intp)
+    codes[x < 0] = N
+    codes[x >= N] = N + 1
+    codes[np.isnan(x)] = N + 2
+    if masked:
+      codes[np.ma.getmaskarray(block)] = N + 2
+    np.take(lut, codes, axis=0, out=out[r0:r0 + block_rows])
+  with ThreadPoolExecutor(n_workers) as pool:
+    list(pool.map(work, range(0, data.shape[0], block_rows)))
+  return out
+
+
+# 4.9.1.2のノイズを含む画像を，色の範囲を-1から1に制限して色付けする．
+# カラーバーには，同じカラーマップと範囲を持つScalarMappableを使う．
+
+cmap = plt.get_cmap('RdBu')
+rgba = colorize(I, cmap, vmin=-1, vmax=1)
+plt.figure()
+plt.imshow(rgba)
+plt.colorbar(mpl.cm.ScalarMappable(norm=plt.Normalize(-1, 1), cmap=cmap), ax=plt.gca(), extend='both')
+
+# Matplotlibのカラーマップによる変換と完全に一致する．
+print(np.array_equal(rgba, cmap(plt.Normalize(-1, 1)(I), bytes=True)))
+# True
+
+# グレースケール版や，無効値の色を変えたカラーマップも，それぞれ表が1回だけ作られる．
+gray = colorize(I, 'viridis', gray=True)
+masked = cmap.with_extremes(bad='black')
+J = I.copy()
+J[speckles] = np.nan
+rgba_bad = colorize(J, masked, vmin=-1, vmax=1)
+len(_LUT_CACHE)
+# 3
+
+# np.maでマスクした値も，plt.imshowと同じく無効値の色で塗られる．
+rgba_ma = colorize(np.ma.masked_array(I, mask=speckles), masked, vmin=-1, vmax=1)
+print(np.array_equal(rgba_ma, rgba_bad))
+# True
+
+
+# 8k×8kの画像で，Matplotlibのカラーマップによる変換と時間を比較する．
+def benchmark_colorize(size=8192, n_workers=4):
+  x = np.linspace(0, 10, size, dtype=np.float32)
+  image = np.sin(x) * np.cos(x[:, np.newaxis])
+  cmap = plt.get_cmap('viridis')
+  norm = plt.Normalize(-1, 1)
+  t0 = time.perf_counter()
+  expected = cmap(norm(image), bytes=True)
+  t_mpl = time.perf_counter() - t0
+  out = np.empty(image.shape + (4,), dtype=np.uint8)
+  colorize(image, cmap, -1, 1, out=out, n_workers=n_workers)   # 表を作る
+  t0 = time.perf_counter()
+  colorize(image, cmap, -1, 1, out=out, n_workers=n_workers)
+  t_lut = time.perf_counter() - t0
+  print("cmap(norm(image), bytes=True): {0:.2f} s, colorize: {1:.2f} s (x{2:.1f}), equal={3}".format(
+    t_mpl, t_lut, t_mpl / t_lut, np.array_equal(out, expected)))
+
+#benchmark_colorize()
\ No newline at end of file